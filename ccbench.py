@@ -0,0 +1,156 @@
+#----------------------------------------------------------------------------------#
+# Cold-Start Benchmark for the Church Calendar Converter
+# Import time and first-call latency of ccconv2, each run in a fresh
+# interpreter, checked against a budget and appended to a results file.
+#----------------------------------------------------------------------------------#
+
+import json, os, platform, subprocess, sys, time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTSPATH = os.path.join(HERE, "ccbench.jsonl")
+
+# Milliseconds; medians over the runs must stay within these
+BUDGET = {"import": 50.0, "first": 10.0}
+
+#=====================================
+# NOTE Measurements
+#=====================================
+# Each run starts a new interpreter, so nothing is cached between runs:
+#   import   wall time of "import ccconv2"
+#   first    the first churchCalendar call after import (builds a table)
+#   second   a second call in the same year, for comparison
+# One more run with -X importtime gives the breakdown by module.
+
+COLDSTART = """
+import json, time
+began = time.perf_counter()
+import ccconv2
+imported = time.perf_counter()
+from datetime import date
+today = date.today()
+ccconv2.churchCalendar(today)
+first = time.perf_counter()
+ccconv2.churchCalendar(today.replace(day=1) if today.day > 1 else today.replace(day=2))
+second = time.perf_counter()
+print(json.dumps({"import": imported - began, "first": first - imported, "second": second - first}))
+"""
+
+def ColdStart():
+    out = subprocess.run([sys.executable, "-c", COLDSTART], cwd=HERE, check=True,
+        capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def ImportTimes():
+    # [(module, self us, cumulative us)] from -X importtime, slowest first
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import ccconv2"], cwd=HERE,
+        check=True, capture_output=True, text=True).stderr
+    modules = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(own), int(cumulative)))
+    modules.sort(key=lambda entry: -entry[1])
+    return modules
+
+def Median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+def GitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def Measure(runs=7, top=8):
+    samples = [ColdStart() for run in range(runs)]
+    modules = ImportTimes()
+    total = dict((name, cumulative) for name, own, cumulative in modules).get("ccconv2")
+    return {
+        "when": datetime.now().isoformat(timespec="seconds"),
+        "commit": GitCommit(),
+        "python": platform.python_version(),
+        "runs": runs,
+        "import_ms": Median([sample["import"] for sample in samples]) * 1e3,
+        "first_ms": Median([sample["first"] for sample in samples]) * 1e3,
+        "second_ms": Median([sample["second"] for sample in samples]) * 1e3,
+        "importtime_ms": total / 1e3 if total is not None else None,
+        "slowest": [[name, own / 1e3] for name, own, cumulative in modules[:top]],
+    }
+
+#=====================================
+# NOTE Results
+#=====================================
+# One JSON object per line, newest last.  Lines that are not JSON
+# objects (from anything else written to the file) are skipped.
+
+def LastResult(path=RESULTSPATH):
+    last = None
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if type(result) is dict:
+                    last = result
+    except FileNotFoundError:
+        return None
+    return last
+
+def SaveResult(result, path=RESULTSPATH):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+
+def OverBudget(result, budget=BUDGET):
+    return [(name, result[name + "_ms"], limit) for name, limit in budget.items()
+        if result[name + "_ms"] > limit]
+
+def FormatResult(result, previous=None):
+    lines = []
+    for name in ("import", "first", "second", "importtime"):
+        value = result[name + "_ms"]
+        if value is None:
+            continue
+        line = "%-11s %8.2f ms" % (name, value)
+        if previous is not None and previous.get(name + "_ms"):
+            line += "   (%+.2f since %s)" % (value - previous[name + "_ms"], previous.get("commit") or previous["when"])
+        lines.append(line)
+    lines.append("slowest imports (self time):")
+    for name, ms in result["slowest"]:
+        lines.append("    %-28s %6.2f ms" % (name, ms))
+    return "\n".join(lines)
+
+#=====================================
+# NOTE Command Line
+#=====================================
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="ccbench",
+        description="Measure cold import and first-call time of ccconv2 against a budget.")
+    parser.add_argument("--runs", type=int, default=7, help="fresh interpreters to take the median of")
+    parser.add_argument("--import-budget", type=float, metavar="MS", default=BUDGET["import"])
+    parser.add_argument("--first-budget", type=float, metavar="MS", default=BUDGET["first"])
+    parser.add_argument("--output", metavar="PATH", default=RESULTSPATH,
+        help="results file, one JSON line per run (default: ccbench.jsonl)")
+    parser.add_argument("--no-save", action="store_true", help="do not append to the results file")
+    args = parser.parse_args(argv)
+
+    previous = LastResult(args.output)
+    result = Measure(args.runs)
+    print(FormatResult(result, previous))
+    if not args.no_save:
+        SaveResult(result, args.output)
+    over = OverBudget(result, {"import": args.import_budget, "first": args.first_budget})
+    for name, value, limit in over:
+        print("OVER BUDGET: %s %.2f ms > %.2f ms" % (name, value, limit), file=sys.stderr)
+    return 1 if over else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
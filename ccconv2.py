@@ -12,42 +12,138 @@
 # See http://www.romcal.net/ for additional credits and informations
 #----------------------------------------------------------------------------------#
 
-import calendar, csv
+import calendar, csv, os, struct, sys, threading, time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
 from dateutil.easter import *
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, MINYEAR, MAXYEAR
+
+#=====================================
+# NOTE Errors
+#=====================================
+# churchCalendar prints a failed stage and carries on, leaving the
+# attribute unset.  With strict=True it raises a ConversionError naming
+# the stage instead, and given a batchReport it records the failure
+# there without printing: a date counts once in total and in failed,
+# and once per failed stage in counts.
+
+class CalendarError(ValueError):
+    pass
+
+class ConversionError(CalendarError):
+    def __init__(self, stage, datein):
+        if stage == "input":
+            message = "Error: Cannot read a date from %r." % (datein,)
+        else:
+            message = "Error: Could not determine %s for %s." % (stage, datein)
+        CalendarError.__init__(self, message)
+        self.stage = stage
+        self.datein = datein
+
+class batchReport:
+    def __init__(self, keep=10):
+        self.keep = keep
+        self.total = 0
+        self.failed = 0
+        self.counts = {}
+        self.first = []
+
+    def Add(self, value, stage, err, new=True):
+        # new=False for a further stage of a value already counted
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        if new:
+            self.failed += 1
+            if len(self.first) < self.keep:
+                self.first.append((value, stage, str(err)))
+
+    def Summary(self):
+        if not self.failed:
+            return "%d converted, no errors." % self.total
+        counts = ", ".join("%s %d" % item for item in sorted(self.counts.items()))
+        lines = ["%d of %d failed (%s), first:" % (self.failed, self.total, counts)]
+        for value, stage, message in self.first:
+            lines.append("  %r %s: %s" % (value, stage, message))
+        return "\n".join(lines)
+
+def ConversionFailed(stage, datein, err, strict, report, failed=False):
+    # Returns True, for the caller's "already failed" flag
+    if strict:
+        raise ConversionError(stage, datein) from err
+    if report is not None:
+        report.Add(datein, stage, err, not failed)
+    else:
+        print("Error: Could not determine %s." % stage)
+    return True
 
 #=====================================
 # NOTE Set Church Calendar Var
 #=====================================
 
 class churchCalendar:
-    def __init__(self, datein):
+    def __init__(self, datein, observances=None, strict=False, report=None):
+        began = time.perf_counter() if metrics.enabled else 0.0
+        if report is not None:
+            report.total += 1
+        try:
+            datein = NormalizeDate(datein)
+        except (TypeError, ValueError, OverflowError) as err:
+            # Unreadable input raises as is unless strict or reporting
+            if not strict and report is None:
+                raise
+            ConversionFailed("input", datein, err, strict, report)
+            self.year = self.churchseason = self.churchweek = self.day = False
+            self.holyday = self.colour = self.rank = False
+            return
+
+        # Local observances come from the default registry unless given
+        if observances is None:
+            observances = registry
+
+        # Fast path through the cached year table
+        if HasYearTable(datein):
+            observances.cache.Get(datein.year).Fill(self, datein)
+            self.holyday = observances.Extend(datein, self.holyday)
+            if began:
+                metrics.Observe("single", time.perf_counter() - began)
+            return
+
+        failed = False
+
         # Year
         try:
             self.year = ConvertYear(datein)
-        except:
-            print("Error: Could not determine year.")
+        except Exception as err:
+            failed = ConversionFailed("year", datein, err, strict, report, failed)
         
         # Season
         try:
             self.churchseason = ConvertSeason(datein)
-        except:
-            print("Error: Could not determine season.")
+        except Exception as err:
+            failed = ConversionFailed("season", datein, err, strict, report, failed)
 
         # Week
         try:
             self.churchweek = ConvertWeek(datein)
-        except:
-            print("Error: Could not determine week.")
+        except Exception as err:
+            failed = ConversionFailed("week", datein, err, strict, report, failed)
         
         # Weekday
         self.day = calendar.day_name[datein.weekday()]
         
         # Holy Days
         try:
-            self.holyday = HolyDays(datein)
-        except:
-            print("Error: Could not determine holy days")
+            self.holyday = observances.Extend(datein, HolyDays(datein))
+        except Exception as err:
+            failed = ConversionFailed("holy days", datein, err, strict, report, failed)
+
+        # Colour and Rank only come from the year tables, which these
+        # years do not have (see HasYearTable)
+        self.colour = False
+        self.rank = False
+
+        if began:
+            metrics.Observe("single", time.perf_counter() - began)
 
 #=====================================
 # Library of Conversion Functions
@@ -772,7 +868,7 @@ def MemorialDay(year):
         s+=delta
         e-=delta
         i+=1
-    return "Error: Memorial Day not found."
+    raise CalendarError("Error: Memorial Day not found.")
 
 def ThanksgivingDayUSA(year):
     # 4th Thursday in Nov.
@@ -785,7 +881,7 @@ def ThanksgivingDayUSA(year):
             return tday
         s+=delta
         i+=1
-    return "Error: Thanksgiving Day USA not found."
+    raise CalendarError("Error: Thanksgiving Day USA not found.")
 
 def ThanksgivingDayCanada(year):
     # 2nd Monday in Oct.
@@ -798,7 +894,7 @@ def ThanksgivingDayCanada(year):
             return tday
         s+=delta
         i+=1
-    return "Error: Thanksgiving Day Canada not found."
+    raise CalendarError("Error: Thanksgiving Day Canada not found.")
 
 def RemembranceDay(year):
     return date(year, 11, 11)
@@ -823,6 +919,7 @@ def John(year):
 # 0:year a, 1:year b, 2:year c
 
 def ConvertYear(datein):
+    datein = NormalizeDate(datein)
     if (datein >= FirstSundayOfAdvent(datein.year) and datein <= EndOfYear(datein.year)):
         inyear = datein.year+1
     else:
@@ -845,33 +942,34 @@ def ConvertYear(datein):
 # 6 = Ordinary Time 1-29 + Holy Days
 # 7 = Holy Days
 
+# Tested in this order, first match wins
+
+SEASONTESTS = [
+    [IsEasterTide, "Easter"],
+    [IsHolyWeek, "Holy Week"],
+    [IsLentTime, "Lent"],
+    [IsAdventTime, "Advent"],
+    [IsChristmasTime, "Christmas"],
+    [IsEpiphanyTime, "Epiphany"],
+    [IsOrdinaryTime, "Ordinary"]
+]
+
 def ConvertSeason(datein):
-    if (IsEasterTide(datein)):
-        churchseason = "Easter"
-    elif (IsHolyWeek(datein)):
-        churchseason = "Holy Week"
-    elif (IsLentTime(datein)):
-        churchseason = "Lent"
-    elif (IsAdventTime(datein)):
-        churchseason = "Advent"
-    elif (IsChristmasTime(datein)):
-        churchseason = "Christmas"
-    elif (IsEpiphanyTime(datein)):
-        churchseason = "Epiphany"
-    elif (IsOrdinaryTime(datein)):
-        churchseason = "Ordinary"
+    datein = NormalizeDate(datein)
+    for test, name in SEASONTESTS:
+        if test(datein):
+            churchseason = name
+            break
     # NOTE elif (holyday)
     return churchseason
 
 #----- Find Week ----------
 
-def ConvertWeek(datein):
+def WeekAnchor(datein):
     # Changed Date is set to previous Sunday for easy comparisons
-    churchseason = ConvertSeason(datein)
     changeddate = datein
     d = timedelta(days=(-1))
     i = date.weekday(datein)
-    weeks = []
     while i < 6:
         if changeddate == Christmas(changeddate.year):
             break
@@ -881,6 +979,13 @@ def ConvertWeek(datein):
             break
         changeddate += d
         i = date.weekday(changeddate)
+    return changeddate
+
+def ConvertWeek(datein):
+    datein = NormalizeDate(datein)
+    churchseason = ConvertSeason(datein)
+    changeddate = WeekAnchor(datein)
+    weeks = []
     
     # Get dictionary
     inyear = datein.year
@@ -896,52 +1001,56 @@ def ConvertWeek(datein):
         return weeks[0]
 
 #----- Find Holy Days ----------
+# Feast functions in the order their names are reported
+
+HOLYDAYS = [
+    [HolyName, "The Circumcision and Holy Name"],
+    [StPeter, "Confession of Peter the Apostle"],
+    [StPaul, "Conversion of Paul the Apostle"],
+    [PresentationOfChrist, "The Presentation of Christ"],
+    [StMatthias, "Matthias the Apostle"],
+    [StJoseph, "Joseph, the Guardian of Jesus"],
+    [Annunciation, "The Annunciation"],
+    [StMark, "Mark the Evangelist"],
+    [StsPhilipAndJames, "Philip and James the Apostles"],
+    [Visitation, "The Visitation"],
+    [StBarnabas, "Barnabas the Apostle"],
+    [NativityOfJohnTheBaptist, "The Nativity of John the Baptist"],
+    [StsPeterAndPaul, "Peter and Paul the Apostles"],
+    [CanadaDay, "Canada Day"],
+    [IndependenceDay, "Independence Day"],
+    [StMagdalene, "Mary Magdalene"],
+    [StJames, "James the Elder and the Apostle"],
+    [Transfiguration, "The Transfiguration"],
+    [StMary, "The Virgin Mary"],
+    [StBartholomew, "Bartholomew the Apostle"],
+    [HolyCross, "Holy Cross Day"],
+    [StMatthew, "Matthew the Apostle and Evangelist"],
+    [HolyMichaelAllAngels, "Holy Michael and All Angels"],
+    [StLuke, "Luke the Evangelist and Companion of Paul"],
+    [JamesJerusalem, "James of Jerusalem"],
+    [StSimonAndJude, "Simon and Jude the Apostles"],
+    [AllSaints, "All Saints' Day"],
+    [Stephen, "Stephen, Deacon and Martyr"],
+    [HolyInnocents, "The Holy Innocents"],
+    [Epiphany, "Epiphany"],
+    [Christmas, "The Nativity of our Lord Jesus Christ"],
+    [MemorialDay, "Memorial Day"],
+    [ThanksgivingDayUSA, "Thanksgiving Day (USA)"],
+    [ThanksgivingDayCanada, "Thanksgiving Day (Canada)"],
+    [RemembranceDay, "Remembrance Day"],
+    [Andrew, "Andrew the Apostle"],
+    [Thomas, "Thomas the Apostle"],
+    [John, "John the Apostle and Evangelist"]
+]
 
 def HolyDays(datein):
+    datein = NormalizeDate(datein)
 
     inyear = datein.year
     holydays = []
 
-    hds = [
-        [HolyName(inyear), "The Circumcision and Holy Name"],
-        [StPeter(inyear), "Confession of Peter the Apostle"],
-        [StPaul(inyear), "Conversion of Paul the Apostle"],
-        [PresentationOfChrist(inyear), "The Presentation of Christ"],
-        [StMatthias(inyear), "Matthias the Apostle"],
-        [StJoseph(inyear), "Joseph, the Guardian of Jesus"],
-        [Annunciation(inyear), "The Annunciation"],
-        [StMark(inyear), "Mark the Evangelist"],
-        [StsPhilipAndJames(inyear), "Philip and James the Apostles"],
-        [Visitation(inyear), "The Visitation"],
-        [StBarnabas(inyear), "Barnabas the Apostle"],
-        [NativityOfJohnTheBaptist(inyear), "The Nativity of John the Baptist"],
-        [StsPeterAndPaul(inyear), "Peter and Paul the Apostles"],
-        [CanadaDay(inyear), "Canada Day"],
-        [IndependenceDay(inyear), "Independence Day"],
-        [StMagdalene(inyear), "Mary Magdalene"],
-        [StJames(inyear), "James the Elder and the Apostle"],
-        [Transfiguration(inyear), "The Transfiguration"],
-        [StMary(inyear), "The Virgin Mary"],
-        [StBartholomew(inyear), "Bartholomew the Apostle"],
-        [HolyCross(inyear), "Holy Cross Day"],
-        [StMatthew(inyear), "Matthew the Apostle and Evangelist"],
-        [HolyMichaelAllAngels(inyear), "Holy Michael and All Angels"],
-        [StLuke(inyear), "Luke the Evangelist and Companion of Paul"],
-        [JamesJerusalem(inyear), "James of Jerusalem"],
-        [StSimonAndJude(inyear), "Simon and Jude the Apostles"],
-        [AllSaints(inyear), "All Saints' Day"],
-        [Stephen(inyear), "Stephen, Deacon and Martyr"],
-        [HolyInnocents(inyear), "The Holy Innocents"],
-        [Epiphany(inyear), "Epiphany"],
-        [Christmas(inyear), "The Nativity of our Lord Jesus Christ"],
-        [MemorialDay(inyear), "Memorial Day"],
-        [ThanksgivingDayUSA(inyear), "Thanksgiving Day (USA)"],
-        [ThanksgivingDayCanada(inyear), "Thanksgiving Day (Canada)"],
-        [RemembranceDay(inyear), "Remembrance Day"],
-        [Andrew(inyear), "Andrew the Apostle"],
-        [Thomas(inyear), "Thomas the Apostle"],
-        [John(inyear), "John the Apostle and Evangelist"]
-    ]
+    hds = [[feast(inyear), name] for feast, name in HOLYDAYS]
 
     for key in hds:
         if key[0] == datein:
@@ -1051,6 +1160,1859 @@ def GetDictionary(inyear, churchseason):
 
 
 
+#=====================================
+# NOTE Input Normalization
+#=====================================
+# Everything is reduced to a proleptic ordinal first:
+#   date                     as is
+#   datetime                 its date; aware ones in local time first
+#   "YYYY-MM-DD"             through date.fromisoformat, the C parser
+#   other ISO 8601 strings   through datetime.fromisoformat
+#   int / digit strings      ordinals (8 digit strings are YYYYMMDD)
+#   numpy.datetime64         days since 1970-01-01
+
+UNIXEPOCH = 719163
+
+def ToOrdinal(value):
+    kind = type(value)
+    if kind is date:
+        return value.toordinal()
+    if kind is str:
+        if len(value) == 10:
+            return date.fromisoformat(value).toordinal()
+        if value.isdigit():
+            if len(value) == 8:
+                return IsoOrdinal(value[:4], value[4:6], value[6:8])
+            return int(value)
+        return ToOrdinal(datetime.fromisoformat(value))
+    if isinstance(value, datetime):
+        if value.utcoffset() is not None:
+            value = value.astimezone()
+        return value.toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    if kind.__name__ == "datetime64":
+        return int(value.astype("datetime64[D]").astype("int64")) + UNIXEPOCH
+    if hasattr(value, "__index__") and kind is not bool:
+        return value.__index__()
+    raise TypeError("Error: Cannot read a date from %s." % kind.__name__)
+
+MONTHLENGTHS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def IsoOrdinal(year, month, day):
+    year, month, day = int(year), int(month), int(day)
+    leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    if month < 1 or month > 12 or day < 1 or day > MONTHLENGTHS[month - 1] + (month == 2 and leap):
+        raise ValueError("Error: %04d-%02d-%02d is not a valid date." % (year, month, day))
+    return FirstOrdinal(year) + MONTHDAYS[month - 1] + day - 1 + (month > 2 and leap)
+
+def NormalizeDate(value):
+    if type(value) is date:
+        return value
+    return date.fromordinal(ToOrdinal(value))
+
+def ToOrdinals(values):
+    # NumPy datetime64 arrays convert in one step
+    if type(values).__name__ == "ndarray" and values.dtype.kind == "M":
+        return (values.astype("datetime64[D]").astype("int64") + UNIXEPOCH).tolist()
+    return (ToOrdinal(value) for value in values)
+
+
+
+#=====================================
+# NOTE Year Tables and Cache
+#=====================================
+
+#----- Feast Rules ----------
+# The calendar as data.  Each rule places one date in a year:
+#   FixedDate(month, day)            a fixed date
+#   EasterOffset(days)               days after (or before) Easter
+#   NthWeekday(month, weekday, n)    n-th weekday of the month
+#   NearestWeekday(month, day, wd)   weekday closest to a date
+#   SundayIn(month, day)             Sunday in the week from a date
+# Weekdays count from Monday = 0.  Guards drop a date that is not
+# Before/After a named anchor; transfers move it (first match wins):
+#   OnAnchor(anchor, days)           when it falls on the anchor
+#   EasterBy(month, day, days)       to Easter + days when Easter is by the date
+#   OnWeekday(weekday, days)         when it falls on the weekday
+# An optional third item ranks an entry for precedence (see RANKS) and
+# a fourth gives a feast's colour (see COLOURS).
+
+FIXED, EASTER, NTH, NEAREST, SUNDAY = range(5)
+
+# Precedence, lowest wins.  Sundays default to PRIVILEGED in Advent,
+# Lent and Easter and to SUNDAYRANK otherwise; feasts to HOLYDAY.
+
+PRINCIPAL, PRIVILEGED, LORDSFEAST, SUNDAYRANK, HOLYDAY, CIVIL, FERIA = range(1, 8)
+
+RANKS = (False, "Principal Feast", "Privileged Day", "Feast of our Lord", "Sunday",
+    "Holy Day", "Civil Observance", "Weekday")
+
+# Liturgical colours.  Feasts default to WHITE, civil observances keep
+# the colour of the season.
+
+WHITE, RED, VIOLET, GREEN, ROSE, BLACK = range(1, 7)
+
+COLOURS = (False, "White", "Red", "Violet", "Green", "Rose", "Black")
+
+feastRule = namedtuple("feastRule", "kind month day offset weekday window yearshift guards transfers")
+
+def FixedDate(month, day, transfers=(), yearshift=0):
+    return feastRule(FIXED, month, day, 0, 0, 0, yearshift, (), transfers)
+
+def EasterOffset(days, guards=()):
+    return feastRule(EASTER, 1, 1, days, 0, 0, 0, guards, ())
+
+def NthWeekday(month, weekday, n):
+    return feastRule(NTH, month, 1, 7 * (n - 1), weekday, 0, 0, (), ())
+
+def NearestWeekday(month, day, weekday):
+    return feastRule(NEAREST, month, day, 0, weekday, 0, 0, (), ())
+
+def SundayIn(month, day, offset=0, window=7, yearshift=0, guards=()):
+    # Falls back to the last day of the window when it holds no Sunday
+    return feastRule(SUNDAY, month, day, offset, 6, window, yearshift, guards, ())
+
+def Before(anchor):
+    return ("before", anchor)
+
+def After(anchor):
+    return ("after", anchor)
+
+def OnAnchor(anchor, days):
+    return ("on", anchor, days)
+
+def EasterBy(month, day, days):
+    return ("easterby", month, day, days)
+
+def OnWeekday(weekday, days):
+    return ("weekday", weekday, days)
+
+# Dates the seasons and weeks are measured from
+
+ANCHORS = [
+    ["adventone", SundayIn(11, 27)],
+    ["christmas", FixedDate(12, 25)],
+    ["epiphany", FixedDate(1, 6)],
+    ["ashwednesday", EasterOffset(-46)],
+    ["palmsunday", EasterOffset(-7)],
+    ["easter", EasterOffset(0)],
+    ["trinity", EasterOffset(56)],
+    ["lastchristmas", FixedDate(12, 25, yearshift=-1)],
+    ["penultimate", EasterOffset(-56)],
+    ["lastepiphanyone", SundayIn(1, 2, yearshift=-1)]
+]
+
+# Sunday names by season, as in GetDictionary
+
+WEEKRULES = [
+    ["Advent", [
+        [SundayIn(11, 27), "First Sunday of Advent"],
+        [SundayIn(11, 27, 7), "Second Sunday of Advent"],
+        [SundayIn(11, 27, 14), "Third Sunday of Advent"],
+        [SundayIn(11, 27, 21), "Fourth Sunday of Advent"]
+        ]],
+    ["Christmas", [
+        [FixedDate(12, 25), "Christmas", PRINCIPAL],
+        [SundayIn(12, 26, window=6), "Christmas One"],
+        [SundayIn(12, 26, 7, window=6, yearshift=-1, guards=(Before("lastepiphanyone"),)), "Christmas Two"],
+        [SundayIn(12, 25, yearshift=-1), "Christmas One"],
+        [SundayIn(12, 25, 7, yearshift=-1, guards=(Before("epiphany"),)), "Christmas Two"]
+        ]],
+    ["Epiphany", [
+        [FixedDate(1, 6), "Epiphany", PRINCIPAL],
+        [SundayIn(1, 2), "Epiphany One"],
+        [SundayIn(1, 2, 7), "Epiphany Two"],
+        [SundayIn(1, 2, 14), "Epiphany Three"],
+        [SundayIn(1, 2, 21, guards=(Before("penultimate"),)), "Epiphany Four"],
+        [SundayIn(1, 2, 28, guards=(Before("penultimate"),)), "Epiphany Five"],
+        [SundayIn(1, 2, 35, guards=(Before("penultimate"),)), "Epiphany Six"],
+        [SundayIn(1, 2, 42, guards=(Before("penultimate"),)), "Epiphany Seven"],
+        [SundayIn(1, 2, 49, guards=(Before("penultimate"),)), "Epiphany Eight"],
+        [EasterOffset(-56), "Epiphany Penultimate"],
+        [EasterOffset(-49), "Epiphany Ultimate"]
+        ]],
+    ["Lent", [
+        [EasterOffset(-46), "Ash Wednesday", PRINCIPAL],
+        [EasterOffset(-42), "Lent One"],
+        [EasterOffset(-35), "Lent Two"],
+        [EasterOffset(-28), "Lent Three"],
+        [EasterOffset(-21), "Lent Four"],
+        [EasterOffset(-14), "Lent Five"]
+        ]],
+    ["Holy Week", [
+        [EasterOffset(-7), "Palm Sunday", PRINCIPAL],
+        [EasterOffset(-3), "Holy Thursday", PRINCIPAL],
+        [EasterOffset(-2), "Good Friday", PRINCIPAL]
+        ]],
+    ["Easter", [
+        [EasterOffset(-1), "Easter Vigil"],
+        [EasterOffset(0), "Easter One", PRINCIPAL],
+        [EasterOffset(7), "Easter Two"],
+        [EasterOffset(14), "Easter Three"],
+        [EasterOffset(21), "Easter Four"],
+        [EasterOffset(28), "Easter Five"],
+        [EasterOffset(35), "Easter Six"],
+        [EasterOffset(40), "Ascension", PRINCIPAL],
+        [EasterOffset(42), "Sunday after Ascension"],
+        [EasterOffset(49), "Pentecost", PRINCIPAL]
+        ]],
+    ["Ordinary", [
+        [EasterOffset(56), "Trinity Sunday", PRINCIPAL],
+        [SundayIn(5, 8, guards=(After("trinity"),)), "Ordinary One"],
+        [SundayIn(5, 15, guards=(After("trinity"),)), "Ordinary Two"],
+        [SundayIn(5, 22, guards=(After("trinity"),)), "Ordinary Three"],
+        [SundayIn(5, 29, guards=(After("trinity"),)), "Ordinary Four"],
+        [SundayIn(6, 5, guards=(After("trinity"),)), "Ordinary Five"],
+        [SundayIn(6, 12, guards=(After("trinity"),)), "Ordinary Six"],
+        [SundayIn(6, 19, guards=(After("trinity"),)), "Ordinary Seven"],
+        [SundayIn(6, 26, guards=(After("trinity"),)), "Ordinary Eight"],
+        [SundayIn(7, 3, guards=(After("trinity"),)), "Ordinary Nine"],
+        [SundayIn(7, 10), "Ordinary Ten"],
+        [SundayIn(7, 17), "Ordinary Eleven"],
+        [SundayIn(7, 24), "Ordinary Twelve"],
+        [SundayIn(7, 31), "Ordinary Thirteen"],
+        [SundayIn(8, 7), "Ordinary Fourteen"],
+        [SundayIn(8, 14), "Ordinary Fifteen"],
+        [SundayIn(8, 21), "Ordinary Sixteen"],
+        [SundayIn(8, 28), "Ordinary Seventeen"],
+        [SundayIn(9, 4), "Ordinary Eighteen"],
+        [SundayIn(9, 11), "Ordinary Nineteen"],
+        [SundayIn(9, 18), "Ordinary Twenty"],
+        [SundayIn(9, 25), "Ordinary Twenty One"],
+        [SundayIn(10, 2), "Ordinary Twenty Two"],
+        [SundayIn(10, 9), "Ordinary Twenty Three"],
+        [SundayIn(10, 16), "Ordinary Twenty Four"],
+        [SundayIn(10, 23), "Ordinary Twenty Five"],
+        [SundayIn(10, 30), "Ordinary Twenty Six"],
+        [SundayIn(11, 6), "Ordinary Twenty Seven"],
+        [SundayIn(11, 13), "Ordinary Twenty Eight"],
+        [SundayIn(11, 20), "Christ the King"]
+        ]]
+]
+
+# Holy days, in the order HolyDays reports them
+
+FEASTS = [
+    [FixedDate(1, 1), "The Circumcision and Holy Name", LORDSFEAST],
+    [FixedDate(1, 18), "Confession of Peter the Apostle"],
+    [FixedDate(1, 25), "Conversion of Paul the Apostle"],
+    [FixedDate(2, 2), "The Presentation of Christ", LORDSFEAST],
+    [FixedDate(2, 24), "Matthias the Apostle", HOLYDAY, RED],
+    [FixedDate(3, 19, (OnAnchor("palmsunday", -1),)), "Joseph, the Guardian of Jesus"],
+    [FixedDate(3, 25, (EasterBy(4, 2, 8), OnWeekday(6, 1))), "The Annunciation"],
+    [FixedDate(4, 25), "Mark the Evangelist", HOLYDAY, RED],
+    [FixedDate(5, 1), "Philip and James the Apostles", HOLYDAY, RED],
+    [FixedDate(5, 31), "The Visitation"],
+    [FixedDate(6, 11), "Barnabas the Apostle", HOLYDAY, RED],
+    [FixedDate(6, 24), "The Nativity of John the Baptist"],
+    [FixedDate(6, 29), "Peter and Paul the Apostles", HOLYDAY, RED],
+    [FixedDate(7, 1), "Canada Day", CIVIL],
+    [FixedDate(7, 4), "Independence Day", CIVIL],
+    [FixedDate(7, 22), "Mary Magdalene"],
+    [FixedDate(7, 25), "James the Elder and the Apostle", HOLYDAY, RED],
+    [FixedDate(8, 6), "The Transfiguration", LORDSFEAST],
+    [FixedDate(8, 15), "The Virgin Mary"],
+    [FixedDate(8, 24), "Bartholomew the Apostle", HOLYDAY, RED],
+    [FixedDate(9, 14), "Holy Cross Day", HOLYDAY, RED],
+    [FixedDate(9, 21), "Matthew the Apostle and Evangelist", HOLYDAY, RED],
+    [FixedDate(9, 29), "Holy Michael and All Angels"],
+    [FixedDate(10, 18), "Luke the Evangelist and Companion of Paul", HOLYDAY, RED],
+    [FixedDate(10, 23), "James of Jerusalem", HOLYDAY, RED],
+    [FixedDate(10, 28), "Simon and Jude the Apostles", HOLYDAY, RED],
+    [FixedDate(11, 1), "All Saints' Day", PRINCIPAL],
+    [FixedDate(12, 26), "Stephen, Deacon and Martyr", HOLYDAY, RED],
+    [FixedDate(12, 28), "The Holy Innocents", HOLYDAY, RED],
+    [FixedDate(1, 6), "Epiphany", PRINCIPAL],
+    [FixedDate(12, 25), "The Nativity of our Lord Jesus Christ", PRINCIPAL],
+    [NearestWeekday(5, 28, 0), "Memorial Day", CIVIL],
+    [NthWeekday(11, 3, 4), "Thanksgiving Day (USA)", CIVIL],
+    [NthWeekday(10, 0, 2), "Thanksgiving Day (Canada)", CIVIL],
+    [FixedDate(11, 11), "Remembrance Day", CIVIL],
+    [FixedDate(11, 30), "Andrew the Apostle", HOLYDAY, RED],
+    [FixedDate(12, 21), "Thomas the Apostle", HOLYDAY, RED],
+    [FixedDate(12, 27), "John the Apostle and Evangelist"]
+]
+
+#----- Codes for Table Fields ----------
+# Each table stores small integer codes into these tuples.
+# Week code 0 and an empty holy day mask stand for False; holy days
+# are a bit mask over the rule set's feasts, so lowest bit first
+# keeps their order.
+
+CYCLES = ("Year A", "Year B", "Year C")
+
+SEASONS = ("Advent", "Christmas", "Epiphany", "Lent", "Holy Week", "Easter", "Ordinary")
+
+WEEKS = (False,)
+for entry in WEEKRULES:
+    for key in entry[1]:
+        if key[1] not in WEEKS:
+            WEEKS += (key[1],)
+
+WEEKCODES = dict((label, code) for code, label in enumerate(WEEKS) if code)
+
+# Colour of each season, and of the days that differ from their season
+
+SEASONCOLOURS = (VIOLET, WHITE, GREEN, VIOLET, RED, WHITE, GREEN)
+
+WEEKCOLOURS = {
+    "Third Sunday of Advent": ROSE,
+    "Epiphany One": WHITE,
+    "Epiphany Ultimate": WHITE,
+    "Lent Four": ROSE,
+    "Holy Thursday": WHITE,
+    "Good Friday": BLACK,
+    "Pentecost": RED,
+    "Trinity Sunday": WHITE,
+    "Christ the King": WHITE
+}
+
+# Dictionary entries that are proper to their day without being Sundays;
+# any other entry only ranks the day it names when that is a Sunday
+
+WEEKDAYPROPERS = frozenset(WEEKCODES[label] for label in
+    ("Christmas", "Epiphany", "Ash Wednesday", "Holy Thursday", "Good Friday", "Ascension"))
+
+#----- Compiled Rules ----------
+# Anchors, Sunday names and feasts flattened into parallel arrays and
+# evaluated for a year with ordinal arithmetic only.
+
+MONTHDAYS = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+
+def FirstOrdinal(year):
+    y = year - 1
+    return y * 365 + y // 4 - y // 100 + y // 400 + 1
+
+# Holy days are a 64-bit mask per day, one bit per feast
+
+MAXFEASTS = 64
+
+class ruleSet:
+    def __init__(self, feasts=FEASTS, weeks=WEEKRULES):
+        if len(feasts) > MAXFEASTS:
+            raise ValueError("Error: A rule set holds at most %d feasts, not %d." % (MAXFEASTS, len(feasts)))
+        self.anchors = dict((entry[0], i) for i, entry in enumerate(ANCHORS))
+        rules = [entry[1] for entry in ANCHORS]
+        self.weeks = []
+        for churchseason in SEASONS:
+            rank = PRIVILEGED if churchseason in ("Advent", "Lent", "Easter") else SUNDAYRANK
+            lookup = []
+            for entry in weeks:
+                if entry[0] == churchseason:
+                    for key in entry[1]:
+                        lookup.append((len(rules), WEEKCODES[key[1]], key[2] if len(key) > 2 else rank))
+                        rules.append(key[0])
+            self.weeks.append(lookup)
+        self.feasts = list(range(len(rules), len(rules) + len(feasts)))
+        self.names = [entry[1] for entry in feasts]
+        self.ranks = array("b", [entry[2] if len(entry) > 2 else HOLYDAY for entry in feasts])
+        self.colours = array("b", [entry[3] if len(entry) > 3 else 0 if self.ranks[i] == CIVIL else WHITE
+            for i, entry in enumerate(feasts)])
+        rules += [entry[0] for entry in feasts]
+
+        self.size = len(rules)
+        self.kind = array("b", [rule.kind for rule in rules])
+        self.month = array("b", [rule.month for rule in rules])
+        self.day = array("b", [rule.day for rule in rules])
+        self.offset = array("h", [rule.offset for rule in rules])
+        self.weekday = array("b", [rule.weekday for rule in rules])
+        self.window = array("b", [rule.window for rule in rules])
+        self.yearshift = array("b", [rule.yearshift for rule in rules])
+        # Guards and transfers are rare, so they stay sparse
+        self.guards = {}
+        self.transfers = {}
+        for i, rule in enumerate(rules):
+            if rule.guards:
+                self.guards[i] = [(guard[0] == "after", self.anchors[guard[1]]) for guard in rule.guards]
+            if rule.transfers:
+                self.transfers[i] = [self.CompileTransfer(transfer) for transfer in rule.transfers]
+
+    def CompileTransfer(self, transfer):
+        if transfer[0] == "on":
+            return (0, self.anchors[transfer[1]], transfer[2])
+        if transfer[0] == "easterby":
+            return (1, (transfer[1], transfer[2]), transfer[3])
+        return (2, transfer[1], transfer[2])
+
+    def Anchor(self, ordinals, name):
+        return ordinals[self.anchors[name]]
+
+    def Evaluate(self, year):
+        # Ordinal of every rule in the year, 0 where a guard drops it
+        ordinals = [0] * self.size
+        easterday = easter(year).toordinal()
+        if metrics.enabled:
+            metrics.Easter()
+        firsts = (FirstOrdinal(year), FirstOrdinal(year - 1))
+        leaps = (calendar.isleap(year), calendar.isleap(year - 1))
+        kind, month, day, offset = self.kind, self.month, self.day, self.offset
+        weekday, window, yearshift = self.weekday, self.window, self.yearshift
+        guards, transfers = self.guards, self.transfers
+        for i in range(self.size):
+            if kind[i] == EASTER:
+                o = easterday + offset[i]
+            else:
+                m = month[i]
+                o = firsts[-yearshift[i]] + MONTHDAYS[m - 1] + day[i] - 1
+                if m > 2 and leaps[-yearshift[i]]:
+                    o += 1
+                if kind[i] == SUNDAY:
+                    s = o + (-o) % 7
+                    if s >= o + window[i]:
+                        s = o + window[i] - 1
+                    o = s + offset[i]
+                elif kind[i] == NTH:
+                    o += (weekday[i] - o - 6) % 7 + offset[i]
+                elif kind[i] == NEAREST:
+                    k = (weekday[i] - o - 6) % 7
+                    o += k if k <= 3 else k - 7
+            if i in guards:
+                for after, ref in guards[i]:
+                    if (o <= ordinals[ref]) if after else (o >= ordinals[ref]):
+                        o = 0
+            if i in transfers:
+                for how, value, shift in transfers[i]:
+                    if how == 0 and o == ordinals[value]:
+                        o += shift
+                        break
+                    if how == 1 and easterday <= firsts[0] + MONTHDAYS[value[0] - 1] + value[1] - 1 + (value[0] > 2 and leaps[0]):
+                        o = easterday + shift
+                        break
+                    if how == 2 and (o + 6) % 7 == value:
+                        o += shift
+                        break
+            ordinals[i] = o
+        return ordinals
+
+defaultrules = ruleSet()
+
+#----- Year Table ----------
+# Every field of churchCalendar for one Gregorian year, indexed by
+# day of year (0 = January 1).
+
+class yearTable:
+    def __init__(self, year, rules=None):
+        self.year = year
+        self.rules = rules if rules is not None else defaultrules
+        self.start = date(year, 1, 1).toordinal()
+        self.length = 366 if calendar.isleap(year) else 365
+        self.cycle = array("B", bytes(self.length))
+        self.season = array("B", bytes(self.length))
+        self.week = array("B", bytes(self.length))
+        self.holy = array("Q", bytes(8 * self.length))
+        self.rank = array("B", bytes(self.length))
+        self.colour = array("B", bytes(self.length))
+        self.principal = array("H", bytes(2 * self.length))
+
+    def Index(self, datein):
+        i = datein.toordinal() - self.start
+        if i < 0 or i >= self.length:
+            raise ValueError("Error: %s is not in year %d." % (datein, self.year))
+        return i
+
+    def HolyDays(self, i):
+        mask = self.holy[i]
+        if not mask:
+            return False
+        names = self.rules.names
+        holydays = []
+        while mask:
+            low = mask & -mask
+            holydays.append(names[low.bit_length() - 1])
+            mask ^= low
+        return holydays
+
+    def Principal(self, i):
+        # Week codes first, then the rule set's feasts
+        code = self.principal[i]
+        if code < len(WEEKS):
+            return WEEKS[code]
+        return self.rules.names[code - len(WEEKS)]
+
+    def Fill(self, cal, datein):
+        return self.FillIndex(cal, self.Index(datein))
+
+    def FillIndex(self, cal, i):
+        cal.year = CYCLES[self.cycle[i]]
+        cal.churchseason = SEASONS[self.season[i]]
+        cal.churchweek = WEEKS[self.week[i]]
+        cal.day = calendar.day_name[(self.start + i + 6) % 7]
+        cal.holyday = self.HolyDays(i)
+        cal.colour = COLOURS[self.colour[i]]
+        cal.rank = RANKS[self.rank[i]]
+        return cal
+
+def BuildYearTable(year, rules=None):
+    table = yearTable(year, rules)
+    rules = table.rules
+    start = table.start
+    ordinals = rules.Evaluate(year)
+
+    # Season boundaries as ordinals
+    adventone = rules.Anchor(ordinals, "adventone")
+    christmas = rules.Anchor(ordinals, "christmas")
+    epiphany = rules.Anchor(ordinals, "epiphany")
+    ashwednesday = rules.Anchor(ordinals, "ashwednesday")
+    palmsunday = rules.Anchor(ordinals, "palmsunday")
+    easterday = rules.Anchor(ordinals, "easter")
+    trinity = rules.Anchor(ordinals, "trinity")
+
+    # First matching label per Sunday, for each season's dictionary
+    lookups = []
+    for weeks in rules.weeks:
+        lookup = {}
+        for i, code, rank in weeks:
+            if ordinals[i] and ordinals[i] not in lookup:
+                lookup[ordinals[i]] = (code, rank)
+        lookups.append(lookup)
+
+    # ConvertWeek walks back to the last Sunday, Christmas, Ash Wednesday
+    # or Epiphany; scanning forward keeps that anchor as we go.  Early
+    # January can only walk back as far as late December.
+    stops = set([christmas, epiphany, ashwednesday, rules.Anchor(ordinals, "lastchristmas")])
+    anchor = start - 1
+    while (anchor + 6) % 7 != 6 and anchor not in stops:
+        anchor -= 1
+
+    cycle = year % 3
+    for i in range(table.length):
+        o = start + i
+        if o >= easterday and o < trinity:
+            churchseason = 5
+        elif o >= palmsunday and o < easterday:
+            churchseason = 4
+        elif o >= ashwednesday and o < easterday:
+            churchseason = 3
+        elif o >= adventone and o < christmas:
+            churchseason = 0
+        elif o < epiphany or o >= christmas:
+            churchseason = 1
+        elif o < ashwednesday:
+            churchseason = 2
+        else:
+            churchseason = 6
+        if (o + 6) % 7 == 6 or o in stops:
+            anchor = o
+        table.cycle[i] = cycle if o >= adventone else (year + 2) % 3
+        table.season[i] = churchseason
+        week = lookups[churchseason].get(anchor)
+        table.week[i] = week[0] if week else 0
+
+        # The day's own rank before any feasts
+        proper = lookups[churchseason].get(o)
+        if proper and (o + 6) % 7 != 6 and proper[0] not in WEEKDAYPROPERS:
+            # e.g. Christmas One falling back to Saturday December 31
+            proper = None
+        if proper:
+            table.rank[i] = proper[1]
+            table.principal[i] = proper[0]
+            table.colour[i] = WEEKCOLOURS.get(WEEKS[proper[0]], SEASONCOLOURS[churchseason])
+        else:
+            table.rank[i] = PRIVILEGED if churchseason == 4 or o < easterday + 7 and o > easterday else FERIA
+            table.principal[i] = table.week[i]
+            table.colour[i] = SEASONCOLOURS[churchseason]
+
+    # Holy days keep the order of the feast table
+    for code, i in enumerate(rules.feasts):
+        o = ordinals[i]
+        if o >= start and o < start + table.length:
+            table.holy[o - start] |= 1 << code
+    ResolvePrecedence(table, ordinals)
+    return table
+
+#----- Precedence ----------
+# Settles the principal observance of every day once per year, in two
+# passes.  First every feast that keeps its own day is placed, by rank:
+# principal feasts always keep their day, and civil observances only
+# take plain weekdays and are never moved.  Then each other feast that
+# lost its day goes to the next day that is neither privileged nor
+# taken by a feast, so a moved feast never pushes another off its own.
+
+def ResolvePrecedence(table, ordinals):
+    rules = table.rules
+    start = table.start
+    order = sorted(range(len(rules.feasts)), key=lambda code: rules.ranks[code])
+    displaced = []
+    for code in order:
+        rank = rules.ranks[code]
+        i = ordinals[rules.feasts[code]] - start
+        if i < 0 or i >= table.length:
+            continue
+        if rank != PRINCIPAL and rank >= table.rank[i]:
+            if rank != CIVIL:
+                displaced.append((code, i))
+            continue
+        PlaceFeast(table, code, i)
+    for code, i in displaced:
+        while i < table.length and table.rank[i] < CIVIL:
+            i += 1
+        if i < table.length:
+            PlaceFeast(table, code, i)
+
+def PlaceFeast(table, code, i):
+    rules = table.rules
+    table.rank[i] = rules.ranks[code]
+    table.principal[i] = len(WEEKS) + code
+    if rules.colours[code]:
+        table.colour[i] = rules.colours[code]
+
+def ConvertRange(start, end, observances=None):
+    # (date, churchCalendar) for start <= date < end, straight from the tables
+    days = RangeDays(start, end, observances)
+    return metrics.Timed("range", days) if metrics.enabled else days
+
+def RangeDays(start, end, observances=None):
+    if observances is None:
+        observances = registry
+    o = ToOrdinal(start)
+    stop = ToOrdinal(end)
+    while o < stop:
+        year = date.fromordinal(o).year
+        if not HasYearTable(date(year, 1, 1)):
+            # No table for this year, so each day takes the slow path
+            last = min(stop, date(year, 12, 31).toordinal() + 1)
+            for o in range(o, last):
+                datein = date.fromordinal(o)
+                yield datein, churchCalendar(datein, observances)
+            o = last
+            continue
+        table = observances.cache.Get(year)
+        last = min(stop, table.start + table.length)
+        for o in range(o, last):
+            datein = date.fromordinal(o)
+            cal = table.Fill(churchCalendar.__new__(churchCalendar), datein)
+            cal.holyday = observances.Extend(datein, cal.holyday)
+            yield datein, cal
+        o = last
+
+def ConvertMany(values, observances=None, report=None):
+    # churchCalendar for each of a batch of dates in any accepted form.
+    # Given a batchReport, values that cannot be read yield None and are
+    # recorded there instead of raising.
+    if observances is None:
+        observances = registry
+    if report is not None:
+        cals = ConvertReported(values, observances, report)
+    else:
+        cals = ManyDays(values, observances)
+    return metrics.Timed("batch", cals) if metrics.enabled else cals
+
+def ManyDays(values, observances):
+    table = None
+    for o in ToOrdinals(values):
+        if table is None or o < table.start or o >= table.start + table.length:
+            datein = date.fromordinal(o)
+            if not HasYearTable(datein):
+                # Years without a table take the slow path, as in churchCalendar
+                table = None
+                yield churchCalendar(datein, observances)
+                continue
+            table = observances.cache.Get(datein.year)
+        cal = table.FillIndex(churchCalendar.__new__(churchCalendar), o - table.start)
+        if observances.observances:
+            cal.holyday = observances.Extend(date.fromordinal(o), cal.holyday)
+        yield cal
+
+def ConvertReported(values, observances, report):
+    table = None
+    for value in values:
+        try:
+            o = ToOrdinal(value)
+            if table is None or o < table.start or o >= table.start + table.length:
+                datein = date.fromordinal(o)
+                table = observances.cache.Get(datein.year) if HasYearTable(datein) else None
+        except (TypeError, ValueError, OverflowError) as err:
+            report.total += 1
+            report.Add(value, "input", err)
+            yield None
+            continue
+        if table is None:
+            # The slow path counts the date and records its failures itself
+            yield churchCalendar(datein, observances, report=report)
+            continue
+        report.total += 1
+        cal = table.FillIndex(churchCalendar.__new__(churchCalendar), o - table.start)
+        if observances.observances:
+            cal.holyday = observances.Extend(date.fromordinal(o), cal.holyday)
+        yield cal
+
+def PrincipalObservance(datein):
+    # (name, rank) of the observance that takes the day; (False, False)
+    # in the years without a table, like colour and rank
+    datein = NormalizeDate(datein)
+    if not HasYearTable(datein):
+        return False, False
+    table = GetYearTable(datein.year)
+    i = table.Index(datein)
+    return table.Principal(i), RANKS[table.rank[i]]
+
+#----- Async Range ----------
+# ConvertRange for asyncio services.  Each chunk of days is converted in
+# an executor (the loop's default pool unless one is given), or inline
+# with executor=False, and control returns to the event loop between
+# chunks.  Nothing is converted ahead of the consumer, so a slow reader
+# holds back the producer, and cancelling the consuming task stops it
+# at the next chunk.
+
+def ConvertChunk(first, last, observances=None):
+    return list(ConvertRange(date.fromordinal(first), date.fromordinal(last), observances))
+
+async def aconvert_range(start, end, chunk=366, executor=None, observances=None):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    o = ToOrdinal(start)
+    stop = ToOrdinal(end)
+    while o < stop:
+        last = min(stop, o + chunk)
+        if executor is False:
+            batch = ConvertChunk(o, last, observances)
+            await asyncio.sleep(0)
+        else:
+            batch = await loop.run_in_executor(executor, ConvertChunk, o, last, observances)
+        for item in batch:
+            yield item
+        o = last
+
+#----- Per-Year Cache ----------
+# Bounded LRU of year tables shared by all threads.  A year that is
+# already being built is waited on instead of being built twice.
+
+CacheInfo = namedtuple("CacheInfo", "hits misses evictions maxyears curryears builds buildtime")
+
+class yearCache:
+    def __init__(self, maxyears=64, builder=BuildYearTable):
+        self.maxyears = maxyears
+        self.builder = builder
+        self.lock = threading.Lock()
+        self.tables = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.builds = 0
+        self.buildtime = 0.0
+        # Counts from before the last Clear, for totals that never go down
+        self.cleared = (0, 0, 0)
+
+    def Get(self, year):
+        with self.lock:
+            table = self.tables.get(year)
+            if table is not None:
+                self.tables.move_to_end(year)
+                self.hits += 1
+                return table
+            self.misses += 1
+            build = self.pending.get(year)
+            owner = build is None
+            if owner:
+                build = self.pending[year] = [threading.Event(), None, None]
+        if not owner:
+            build[0].wait()
+            if build[2] is not None:
+                raise build[2]
+            return build[1]
+        try:
+            began = time.perf_counter()
+            table = self.builder(year)
+            elapsed = time.perf_counter() - began
+        except BaseException as e:
+            with self.lock:
+                del self.pending[year]
+            build[2] = e
+            build[0].set()
+            raise
+        if metrics.enabled:
+            metrics.Build(elapsed)
+        with self.lock:
+            self.tables[year] = table
+            self.builds += 1
+            self.buildtime += elapsed
+            self.Trim()
+            del self.pending[year]
+        build[1] = table
+        build[0].set()
+        return table
+
+    def Trim(self):
+        # Caller holds the lock
+        while self.maxyears is not None and len(self.tables) > self.maxyears:
+            self.tables.popitem(last=False)
+            self.evictions += 1
+
+    def Resize(self, maxyears):
+        with self.lock:
+            self.maxyears = maxyears
+            self.Trim()
+
+    def Clear(self):
+        with self.lock:
+            self.tables.clear()
+            hits, misses, evictions = self.cleared
+            self.cleared = (hits + self.hits, misses + self.misses, evictions + self.evictions)
+            self.hits = self.misses = self.evictions = self.builds = 0
+            self.buildtime = 0.0
+
+    def Totals(self):
+        # (hits, misses, evictions) since the cache was created
+        with self.lock:
+            hits, misses, evictions = self.cleared
+            return hits + self.hits, misses + self.misses, evictions + self.evictions
+
+    def Info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxyears,
+                len(self.tables), self.builds, self.buildtime)
+
+yearcache = yearCache()
+
+def GetYearTable(year):
+    return yearcache.Get(year)
+
+def cache_info():
+    return yearcache.Info()
+
+def cache_clear():
+    yearcache.Clear()
+
+def SetCacheSize(maxyears):
+    # None leaves the cache unbounded
+    yearcache.Resize(maxyears)
+
+# The reference functions cannot reach past the first and last
+# representable years, so those are always converted the slow way.
+
+def HasYearTable(datein):
+    return type(datein) is date and datein.year > MINYEAR and datein.year < MAXYEAR
+
+
+
+#----- Local Observances ----------
+# Parish feasts registered at runtime.  They live in a per-registry
+# overlay on top of the shared base tables, so registering or removing
+# one only touches the dates it falls on in the years already held.
+
+class observanceRegistry:
+    def __init__(self, cache=None, maxyears=64):
+        self.cache = cache if cache is not None else yearcache
+        self.maxyears = maxyears
+        self.lock = threading.RLock()
+        self.observances = OrderedDict()
+        self.nextid = 0
+        self.overlays = OrderedDict()
+
+    def Place(self, overlay, handle, rules, year):
+        o = rules.Evaluate(year)[rules.feasts[0]]
+        start = FirstOrdinal(year)
+        if o >= start and o < FirstOrdinal(year + 1):
+            overlay[0][o - start] = overlay[0].get(o - start, 0) | 1 << handle
+            overlay[1][handle] = o - start
+
+    def Overlay(self, year):
+        # ({day of year: mask of handles}, {handle: day of year})
+        with self.lock:
+            overlay = self.overlays.get(year)
+            if overlay is not None:
+                self.overlays.move_to_end(year)
+                return overlay
+            overlay = ({}, {})
+            for handle, entry in self.observances.items():
+                self.Place(overlay, handle, entry[2], year)
+            self.overlays[year] = overlay
+            while self.maxyears is not None and len(self.overlays) > self.maxyears:
+                self.overlays.popitem(last=False)
+            return overlay
+
+    def Register(self, rule, name):
+        rules = ruleSet([[rule, name]], [])
+        with self.lock:
+            handle = self.nextid
+            self.nextid += 1
+            self.observances[handle] = [rule, name, rules]
+            for year, overlay in self.overlays.items():
+                self.Place(overlay, handle, rules, year)
+        return handle
+
+    def Remove(self, handle):
+        with self.lock:
+            del self.observances[handle]
+            for overlay in self.overlays.values():
+                i = overlay[1].pop(handle, None)
+                if i is not None:
+                    mask = overlay[0][i] & ~(1 << handle)
+                    if mask:
+                        overlay[0][i] = mask
+                    else:
+                        del overlay[0][i]
+
+    def Names(self, datein):
+        # Local names for a date, in order of registration
+        if not self.observances:
+            return []
+        datein = NormalizeDate(datein)
+        mask = self.Overlay(datein.year)[0].get(datein.toordinal() - FirstOrdinal(datein.year), 0)
+        names = []
+        while mask:
+            low = mask & -mask
+            entry = self.observances.get(low.bit_length() - 1)
+            if entry is not None:
+                names.append(entry[1])
+            mask ^= low
+        return names
+
+    def Extend(self, datein, holyday):
+        names = self.Names(datein)
+        if not names:
+            return holyday
+        return (holyday or []) + names
+
+    def Calendar(self, datein):
+        return churchCalendar(datein, self)
+
+    def Clear(self):
+        with self.lock:
+            self.observances.clear()
+            self.overlays.clear()
+
+registry = observanceRegistry()
+
+def register_observance(rule, name):
+    # Returns a handle for remove_observance
+    return registry.Register(rule, name)
+
+def remove_observance(handle):
+    registry.Remove(handle)
+
+
+
+#----- Holy Day Index ----------
+# Bitsets over a span of years for set algebra on observances.  Every
+# year takes 366 bits (the last one is never set in common years), so
+# a date's bit is (year - first) * 366 + day of year.  The sets are
+# plain ints: & | ^ combine them, Count and Dates read them back, and
+# Span limits one to a range of dates.  Sets are kept for each feast
+# name in the rule set (not local observances) and for the categories
+#   "holyday"    any holy day
+#   "sunday"     every Sunday
+#   RANKS names  the rank that takes the day, e.g. "Principal Feast"
+
+YEARBITS = 366
+
+PopCount = int.bit_count if hasattr(int, "bit_count") else lambda bits: bin(bits).count("1")
+
+class holyIndex:
+    def __init__(self, first, last, builder=None):
+        if builder is None:
+            builder = yearcache.builder
+        self.first = first
+        self.last = last
+        self.size = YEARBITS * (last - first + 1)
+        nbytes = (self.size + 7) // 8
+        rules = None
+        feasts = None
+        categories = dict((name, bytearray(nbytes)) for name in ("holyday", "sunday") + RANKS[1:])
+        valid = bytearray(nbytes)
+        for year in range(first, last + 1):
+            # Built outside the cache, so a long span does not evict hot years
+            table = builder(year)
+            if rules is None:
+                rules = table.rules
+                feasts = [bytearray(nbytes) for name in rules.names]
+            base = YEARBITS * (year - first)
+            sunday = (-table.start) % 7
+            ranks = [categories[name] for name in RANKS[1:]]
+            for i in range(table.length):
+                pos = base + i
+                byte, bit = pos >> 3, 1 << (pos & 7)
+                valid[byte] |= bit
+                ranks[table.rank[i] - 1][byte] |= bit
+                mask = table.holy[i]
+                if mask:
+                    categories["holyday"][byte] |= bit
+                    while mask:
+                        low = mask & -mask
+                        feasts[low.bit_length() - 1][byte] |= bit
+                        mask ^= low
+            for i in range(sunday, table.length, 7):
+                pos = base + i
+                categories["sunday"][pos >> 3] |= 1 << (pos & 7)
+        self.sets = dict((name, int.from_bytes(bits, "little")) for name, bits in categories.items())
+        for name, bits in zip(rules.names, feasts):
+            self.sets[name] = int.from_bytes(bits, "little")
+        self.valid = int.from_bytes(valid, "little")
+
+    def Position(self, datein):
+        datein = NormalizeDate(datein)
+        if datein.year < self.first or datein.year > self.last:
+            raise ValueError("Error: %s is not in %d-%d." % (datein, self.first, self.last))
+        return YEARBITS * (datein.year - self.first) + datein.toordinal() - FirstOrdinal(datein.year)
+
+    def Bits(self, name):
+        try:
+            return self.sets[name]
+        except KeyError:
+            raise KeyError("Error: No feast or category named %r." % name) from None
+
+    def Names(self):
+        return list(self.sets)
+
+    def Not(self, bits):
+        return self.valid & ~bits
+
+    def Span(self, start, end):
+        # Dates start <= date < end, clipped to the index
+        start, end = NormalizeDate(start), NormalizeDate(end)
+        lo = 0 if start.year < self.first else self.Position(start) if start.year <= self.last else self.size
+        hi = 0 if end.year < self.first else self.Position(end) if end.year <= self.last else self.size
+        if hi <= lo:
+            return 0
+        return (((1 << (hi - lo)) - 1) << lo) & self.valid
+
+    def Contains(self, datein, name="holyday"):
+        return bool(self.Bits(name) >> self.Position(datein) & 1)
+
+    def Count(self, bits):
+        if type(bits) is str:
+            bits = self.Bits(bits)
+        return PopCount(bits)
+
+    def Dates(self, bits):
+        if type(bits) is str:
+            bits = self.Bits(bits)
+        data = bits.to_bytes((self.size + 7) // 8, "little")
+        firsts = {}
+        for byte, value in enumerate(data):
+            if not value:
+                continue
+            for bit in range(8):
+                if value >> bit & 1:
+                    pos = byte * 8 + bit
+                    year = self.first + pos // YEARBITS
+                    start = firsts.get(year)
+                    if start is None:
+                        start = firsts[year] = FirstOrdinal(year)
+                    yield date.fromordinal(start + pos % YEARBITS)
+
+
+
+#----- Shared Year Tables ----------
+# Year tables encoded once into a fixed layout so that pre-forked
+# workers can attach to them read-only instead of building their own.
+#
+# Header: magic, version, first year, last year (native byte order)
+# Then one block per year of YEARBLOCK bytes:
+#   cycle[366], season[366], week[366], rank[366], colour[366], padding,
+#   holy[366] (uint64), principal[366] (uint16), padding
+
+YEARHEADER = struct.Struct("=4sIii")
+YEARMAGIC = b"CCYT"
+YEARVERSION = 3
+BYTECOLUMNS = ("cycle", "season", "week", "rank", "colour")
+HOLYOFFSET = 1832
+PRINCIPALOFFSET = HOLYOFFSET + 8 * 366
+YEARBLOCK = PRINCIPALOFFSET + 2 * 366 + 4
+
+def EncodedSize(first, last):
+    return YEARHEADER.size + YEARBLOCK * (last - first + 1)
+
+def EncodeYears(buf, first, last, builder=BuildYearTable):
+    view = memoryview(buf)
+    YEARHEADER.pack_into(view, 0, YEARMAGIC, YEARVERSION, first, last)
+    offset = YEARHEADER.size
+    for year in range(first, last + 1):
+        table = builder(year)
+        n = table.length
+        for column, name in enumerate(BYTECOLUMNS):
+            view[offset + 366 * column:offset + 366 * column + n] = getattr(table, name).tobytes()
+        view[offset + HOLYOFFSET:offset + HOLYOFFSET + 8 * n] = table.holy.tobytes()
+        view[offset + PRINCIPALOFFSET:offset + PRINCIPALOFFSET + 2 * n] = table.principal.tobytes()
+        offset += YEARBLOCK
+    view.release()
+
+class sharedYearTable(yearTable):
+    def __init__(self, year, block):
+        self.year = year
+        self.start = date(year, 1, 1).toordinal()
+        self.length = 366 if calendar.isleap(year) else 365
+        for column, name in enumerate(BYTECOLUMNS):
+            setattr(self, name, block[366 * column:366 * column + self.length])
+        self.holy = block[HOLYOFFSET:HOLYOFFSET + 8 * self.length].cast("Q")
+        self.principal = block[PRINCIPALOFFSET:PRINCIPALOFFSET + 2 * self.length].cast("H")
+        self.rules = defaultrules
+
+class sharedYears:
+    def __init__(self, buf, shm=None, owner=False):
+        self.buf = buf
+        self.shm = shm
+        self.owner = owner
+        self.view = memoryview(buf).toreadonly()
+        magic, version, self.first, self.last = YEARHEADER.unpack_from(self.view, 0)
+        if magic != YEARMAGIC or version != YEARVERSION:
+            self.view.release()
+            raise ValueError("Error: Not a shared year table block.")
+        self.name = shm.name if shm is not None else None
+
+    def Table(self, year):
+        if year < self.first or year > self.last:
+            return None
+        offset = YEARHEADER.size + YEARBLOCK * (year - self.first)
+        return sharedYearTable(year, self.view[offset:offset + YEARBLOCK])
+
+    def Builder(self, year):
+        table = self.Table(year)
+        if table is None:
+            table = BuildYearTable(year)
+        return table
+
+    def Close(self):
+        # Tables handed out must be dropped first, see UseSharedYears(None)
+        self.view.release()
+        if self.shm is not None:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        elif hasattr(self.buf, "close"):
+            self.buf.close()
+
+def PublishYears(first, last, name=None):
+    # Build [first, last] into a new shared memory block; the caller owns it
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name, create=True, size=EncodedSize(first, last))
+    EncodeYears(shm.buf, first, last)
+    return sharedYears(shm.buf, shm, owner=True)
+
+def AttachYears(name):
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource
+        # tracker; workers forked from the publisher share its tracker, so
+        # the block still lives until the publisher unlinks it.
+        shm = shared_memory.SharedMemory(name=name)
+    return sharedYears(shm.buf, shm)
+
+def SaveYears(path, first, last):
+    buf = bytearray(EncodedSize(first, last))
+    EncodeYears(buf, first, last)
+    with open(path, "wb") as f:
+        f.write(buf)
+
+def MapYears(path):
+    import mmap
+    with open(path, "rb") as f:
+        return sharedYears(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def UseSharedYears(shared):
+    # Serve the default cache from a shared block, or None to go back
+    # to building tables in this process
+    yearcache.builder = shared.Builder if shared is not None else BuildYearTable
+    yearcache.Clear()
+
+
+
+#----- Warm-Up ----------
+# Builds the years around the current one ahead of the first request,
+# and with roll=True keeps re-centring on today's year as time passes.
+# The cache size set with SetCacheSize is left alone: a window larger
+# than the cache is refused, and if the cache shrinks later only the
+# years nearest the centre that fit are kept warm.
+
+class yearWarmer(threading.Thread):
+    def __init__(self, radius=1, center=None, roll=False, interval=3600.0, cache=None):
+        threading.Thread.__init__(self, name="ccconv2-warmer", daemon=True)
+        self.radius = radius
+        self.center = center
+        self.roll = roll
+        self.interval = interval
+        self.cache = cache if cache is not None else yearcache
+        if roll and center is not None:
+            raise ValueError("Error: A rolling window follows the current year, so it takes no center.")
+        if self.cache.maxyears is not None and 2 * radius + 1 > self.cache.maxyears:
+            raise ValueError("Error: Warming %d years does not fit a cache of %d; see SetCacheSize." %
+                (2 * radius + 1, self.cache.maxyears))
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+
+    def Window(self):
+        center = self.center if self.center is not None else date.today().year
+        years = [center]
+        for i in range(1, self.radius + 1):
+            years += [center + i, center - i]
+        return [y for y in years if y > MINYEAR and y < MAXYEAR]
+
+    def Warm(self):
+        window = self.Window()
+        # Nearest years first, and never more than the cache holds
+        if self.cache.maxyears is not None:
+            window = window[:self.cache.maxyears]
+        for year in window:
+            self.cache.Get(year)
+        self.ready.set()
+
+    def run(self):
+        self.Warm()
+        while self.roll and not self.stopped.wait(self.interval):
+            self.Warm()
+
+    def Stop(self):
+        self.stopped.set()
+
+def WarmYears(radius=1, center=None, roll=False, interval=3600.0, background=True):
+    warmer = yearWarmer(radius, center, roll, interval)
+    if background:
+        warmer.start()
+    else:
+        warmer.Warm()
+    return warmer
+
+
+
+#=====================================
+# NOTE Lectionary
+#=====================================
+# Sunday and major day readings from lectionary.csv, loaded on first
+# use into one tuple per (cycle, week code).  Rows for "All" apply to
+# every cycle.  A day takes the readings of its principal observance
+# when it has its own, and of its week otherwise.  Epiphany Penultimate
+# takes the readings of the Epiphany Sunday it replaces, counted from
+# Epiphany One; Epiphany Nine, which only a late Easter reaches, is not
+# a week of its own and is kept by name.
+
+EPIPHANYWEEKS = ("Epiphany One", "Epiphany Two", "Epiphany Three", "Epiphany Four",
+    "Epiphany Five", "Epiphany Six", "Epiphany Seven", "Epiphany Eight", "Epiphany Nine")
+PENULTIMATE = WEEKCODES["Epiphany Penultimate"]
+
+Readings = namedtuple("Readings", "first psalm second gospel")
+
+LECTIONARYPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lectionary.csv")
+
+class lectionaryTable:
+    def __init__(self, path=LECTIONARYPATH):
+        self.readings = [None] * (len(CYCLES) * len(WEEKS))
+        self.named = {}
+        shared = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                citations = Readings(*[sys.intern(row[field]) for field in Readings._fields])
+                citations = shared.setdefault(citations, citations)
+                if row["cycle"] == "All":
+                    cycles = range(len(CYCLES))
+                else:
+                    cycles = [CYCLES.index(row["cycle"])]
+                for cycle in cycles:
+                    if row["week"] in WEEKCODES:
+                        self.readings[cycle * len(WEEKS) + WEEKCODES[row["week"]]] = citations
+                    else:
+                        self.named[(cycle, row["week"])] = citations
+
+    def Get(self, cycle, week):
+        return self.readings[cycle * len(WEEKS) + week]
+
+    def Named(self, cycle, label):
+        if label in WEEKCODES:
+            return self.Get(cycle, WEEKCODES[label])
+        return self.named.get((cycle, label))
+
+    def ForTable(self, table, i):
+        cycle = table.cycle[i]
+        code = table.principal[i]
+        if code < len(WEEKS) and code != PENULTIMATE:
+            citations = self.Get(cycle, code)
+            if citations is not None:
+                return citations
+        week = table.week[i]
+        if week == PENULTIMATE:
+            o = table.start + i
+            jan2 = table.start + 1
+            epiphanyone = jan2 + (-jan2) % 7
+            return self.Named(cycle, EPIPHANYWEEKS[(o - o % 7 - epiphanyone) // 7])
+        return self.Get(cycle, week)
+
+lectionary = None
+lectionarylock = threading.Lock()
+
+def GetLectionary():
+    global lectionary
+    if lectionary is None:
+        with lectionarylock:
+            if lectionary is None:
+                lectionary = lectionaryTable()
+    return lectionary
+
+def readings_for(datein):
+    # None where there is no year table to take the cycle and week from
+    datein = NormalizeDate(datein)
+    if not HasYearTable(datein):
+        return None
+    table = GetYearTable(datein.year)
+    return GetLectionary().ForTable(table, table.Index(datein))
+
+def readings_for_range(start, end):
+    # (date, readings) for start <= date < end
+    lookup = GetLectionary()
+    o = ToOrdinal(start)
+    stop = ToOrdinal(end)
+    while o < stop:
+        year = date.fromordinal(o).year
+        if not HasYearTable(date(year, 1, 1)):
+            last = min(stop, date(year, 12, 31).toordinal() + 1)
+            for o in range(o, last):
+                yield date.fromordinal(o), None
+            o = last
+            continue
+        table = GetYearTable(year)
+        last = min(stop, table.start + table.length)
+        for i in range(o - table.start, last - table.start):
+            yield date.fromordinal(table.start + i), lookup.ForTable(table, i)
+        o = last
+
+
+
+#=====================================
+# NOTE Grids
+#=====================================
+# Month and year calendars for bulletins and web pages, weeks by
+# weekdays, with days outside the month left as None.  A whole month
+# (or year) is read from one year table instead of a churchCalendar per
+# day.  Weeks start on Sunday unless another firstweekday is given
+# (Monday = 0, as in the calendar module).
+
+GridDay = namedtuple("GridDay", "date year churchseason churchweek holyday colour rank")
+MonthGrid = namedtuple("MonthGrid", "year month firstweekday weeks")
+
+def GridWeeks(year, month, firstweekday, observances):
+    first = date(year, month, 1).toordinal()
+    last = first + calendar.monthrange(year, month)[1]
+    days = [None] * ((first + 6 - firstweekday) % 7)
+    if HasYearTable(date(year, 1, 1)):
+        days.extend(TableDays(observances.cache.Get(year), first, last, observances))
+    else:
+        days.extend(SlowDays(first, last, observances))
+    days.extend([None] * (-len(days) % 7))
+    return [days[k:k + 7] for k in range(0, len(days), 7)]
+
+def TableDays(table, first, last, observances):
+    extend = observances.observances
+    for o in range(first, last):
+        i = o - table.start
+        datein = date.fromordinal(o)
+        holyday = table.HolyDays(i)
+        if extend:
+            holyday = observances.Extend(datein, holyday)
+        yield GridDay(datein, CYCLES[table.cycle[i]], SEASONS[table.season[i]],
+            WEEKS[table.week[i]], holyday, COLOURS[table.colour[i]], RANKS[table.rank[i]])
+
+def SlowDays(first, last, observances):
+    # Years without a table (see HasYearTable), one churchCalendar per
+    # day; what the slow path cannot work out is left False
+    report = batchReport()
+    for o in range(first, last):
+        datein = date.fromordinal(o)
+        cal = churchCalendar(datein, observances, report=report)
+        yield GridDay(datein, *[getattr(cal, field, False) for field in GridDay._fields[1:]])
+
+def month_grid(year, month, firstweekday=6, observances=None):
+    if observances is None:
+        observances = registry
+    return MonthGrid(year, month, firstweekday, GridWeeks(year, month, firstweekday, observances))
+
+def year_grid(year, firstweekday=6, observances=None):
+    if observances is None:
+        observances = registry
+    return [MonthGrid(year, month, firstweekday, GridWeeks(year, month, firstweekday, observances))
+        for month in range(1, 13)]
+
+#----- Renderers ----------
+# render_text and render_html take a month grid or a year grid.  The
+# text form marks holy days with * and lists them under the month; the
+# HTML form is a bare table with season and colour classes on each day
+# for the page's own stylesheet.
+
+def WeekLabel(week):
+    # Church week of the first day of the row inside the month
+    for day in week:
+        if day is not None:
+            return day.churchweek or ""
+    return ""
+
+def render_text(grid):
+    if type(grid) is list:
+        return "\n\n".join(render_text(month) for month in grid)
+    names = [calendar.day_abbr[(grid.firstweekday + k) % 7][:2] for k in range(7)]
+    lines = ["%s %d" % (calendar.month_name[grid.month], grid.year),
+        " ".join("%2s " % name for name in names) + "   Week"]
+    holydays = []
+    for week in grid.weeks:
+        cells = []
+        for day in week:
+            if day is None:
+                cells.append("   ")
+                continue
+            cells.append("%2d%s" % (day.date.day, "*" if day.holyday else " "))
+            if day.holyday:
+                holydays.append("  %2d  %s" % (day.date.day, "; ".join(day.holyday)))
+        lines.append(" ".join(cells) + "   " + WeekLabel(week))
+    if holydays:
+        lines.append("")
+        lines.extend(holydays)
+    return "\n".join(line.rstrip() for line in lines)
+
+def CssClass(name):
+    return name.lower().replace(" ", "-") if name else ""
+
+def render_html(grid):
+    from html import escape
+    if type(grid) is list:
+        return "\n".join(render_html(month) for month in grid)
+    names = [calendar.day_abbr[(grid.firstweekday + k) % 7] for k in range(7)]
+    out = ['<table class="church-month">',
+        "<caption>%s %d</caption>" % (calendar.month_name[grid.month], grid.year),
+        "<tr>%s<th>Week</th></tr>" % "".join("<th>%s</th>" % escape(name) for name in names)]
+    for week in grid.weeks:
+        cells = []
+        for day in week:
+            if day is None:
+                cells.append('<td class="empty"></td>')
+                continue
+            holyday = "".join('<span class="holyday">%s</span>' % escape(name) for name in day.holyday or ())
+            cells.append('<td class="%s %s"><span class="day">%d</span>%s</td>' % (
+                CssClass(day.churchseason), CssClass(day.colour), day.date.day, holyday))
+        out.append('<tr>%s<th class="week">%s</th></tr>' % ("".join(cells), escape(WeekLabel(week))))
+    out.append("</table>")
+    return "\n".join(out)
+
+
+
+#=====================================
+# NOTE Explain
+#=====================================
+# How the reference functions reach each field for one date, step by
+# step and timed: every season test in SEASONTESTS order, the Sunday
+# (or feast) ConvertWeek walks back to, the GetDictionary entry that
+# matches it and the entries that are False that year, the HOLYDAYS
+# functions that fall on the date, and whether the year table agrees.
+
+TraceStep = namedtuple("TraceStep", "stage detail seconds")
+
+def explain(datein):
+    clock = time.perf_counter
+    steps = []
+    def step(stage, detail, began):
+        steps.append(TraceStep(stage, detail, clock() - began))
+
+    began = clock()
+    value = datein
+    datein = NormalizeDate(datein)
+    step("input", "%r read as %s (%s)" % (value, datein.isoformat(), calendar.day_name[datein.weekday()]), began)
+
+    began = clock()
+    adventone = FirstSundayOfAdvent(datein.year)
+    cycle = ConvertYear(datein)
+    step("year", "First Sunday of Advent is %s, so %s" % (adventone, cycle), began)
+
+    churchseason = None
+    for test, name in SEASONTESTS:
+        began = clock()
+        try:
+            matched = test(datein)
+        except Exception as err:
+            step("season", "%s failed: %r" % (test.__name__, err), began)
+            break
+        step("season", "%s: %s" % (test.__name__, "yes, %s" % name if matched else "no"), began)
+        if matched:
+            churchseason = name
+            break
+
+    churchweek = False
+    if churchseason is not None:
+        began = clock()
+        changeddate = WeekAnchor(datein)
+        if changeddate.weekday() == 6:
+            reason = "Sunday"
+        else:
+            reason = "stopped at a feast, no Sunday before it"
+        step("week", "walked back to %s (%s)" % (changeddate, reason), began)
+
+        began = clock()
+        dictionary = GetDictionary(datein.year, churchseason)
+        match = None
+        dropped = []
+        for i, key in enumerate(dictionary or ()):
+            if key[0] is False:
+                dropped.append(key[1])
+            elif match is None and key[0] == changeddate:
+                match = i
+        if match is None:
+            detail = "no %s entry for %s, so False" % (churchseason, changeddate)
+        else:
+            churchweek = dictionary[match][1]
+            detail = "%s entry %d: %s" % (churchseason, match, churchweek)
+        if dropped:
+            detail += "; False this year: %s" % ", ".join(dropped)
+        step("week", detail, began)
+
+    began = clock()
+    found = []
+    holyday = []
+    for feast, name in HOLYDAYS:
+        if feast(datein.year) == datein:
+            found.append("%s -> %s" % (feast.__name__, name))
+            holyday.append(name)
+    step("holy days", "; ".join(found) if found else "none of %d feasts" % len(HOLYDAYS), began)
+
+    began = clock()
+    if HasYearTable(datein):
+        builds = yearcache.builds
+        table = GetYearTable(datein.year)
+        cal = table.Fill(churchCalendar.__new__(churchCalendar), datein)
+        differs = []
+        for field, expected in (("year", cycle), ("churchseason", churchseason),
+                ("churchweek", churchweek), ("holyday", holyday or False)):
+            if getattr(cal, field) != expected:
+                differs.append("%s %r" % (field, getattr(cal, field)))
+        detail = "agrees" if not differs else "differs: " + ", ".join(differs)
+        detail += "; %s, %s, principal %s" % (cal.colour, cal.rank, table.Principal(table.Index(datein)))
+        if yearcache.builds != builds:
+            detail += " (table built for %d)" % datein.year
+    else:
+        detail = "no table for year %d, reference only" % datein.year
+    step("table", detail, began)
+    return steps
+
+def FormatExplanation(steps):
+    width = max(len(entry.stage) for entry in steps)
+    return "\n".join("%-*s %9.1fus  %s" % (width, entry.stage, entry.seconds * 1e6, entry.detail)
+        for entry in steps)
+
+
+
+#=====================================
+# NOTE Metrics
+#=====================================
+# Counters and histograms in the Prometheus text format, off until
+# EnableMetrics() (ServeMetrics and the --metrics options turn them on).
+# Calls are timed per API: single (churchCalendar), range (ConvertRange
+# and aconvert_range) and batch (ConvertMany); for the generators only
+# the time spent producing items counts, not the consumer's.  Easter is
+# counted where the rule set computes it, once per year evaluated; the
+# reference functions are not counted.  Cache figures are read from the
+# default cache when the metrics are rendered, with totals that survive
+# cache_clear() and UseSharedYears().
+# Conversions per second is rate(ccconv_conversions_total[...]).
+
+APIS = ("single", "range", "batch")
+LATENCYBUCKETS = (5e-06, 1e-05, 2.5e-05, 5e-05, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+BUILDBUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+class histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def Observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def Lines(self, name, labels=""):
+        lines = []
+        total = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            le = bound if type(bound) is str else "%g" % bound
+            lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, le, total))
+        braces = "{%s}" % labels.rstrip(",") if labels else ""
+        lines.append("%s_sum%s %r" % (name, braces, self.sum))
+        lines.append("%s_count%s %d" % (name, braces, self.count))
+        return lines
+
+class converterMetrics:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def Reset(self):
+        with self.lock:
+            self.conversions = dict.fromkeys(APIS, 0)
+            self.latency = dict((api, histogram(LATENCYBUCKETS)) for api in APIS)
+            self.builds = histogram(BUILDBUCKETS)
+            self.easters = 0
+
+    def Observe(self, api, elapsed, count=1):
+        with self.lock:
+            self.conversions[api] += count
+            self.latency[api].Observe(elapsed)
+
+    def Build(self, elapsed):
+        with self.lock:
+            self.builds.Observe(elapsed)
+
+    def Easter(self):
+        with self.lock:
+            self.easters += 1
+
+    def Timed(self, api, items):
+        clock = time.perf_counter
+        items = iter(items)
+        elapsed = 0.0
+        count = 0
+        try:
+            while True:
+                began = clock()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    elapsed += clock() - began
+                    return
+                elapsed += clock() - began
+                count += 1
+                yield item
+        finally:
+            self.Observe(api, elapsed, count)
+
+    def Render(self):
+        info = cache_info()
+        hits, misses, evictions = yearcache.Totals()
+        with self.lock:
+            lines = ["# HELP ccconv_conversions_total Dates converted, by API.",
+                "# TYPE ccconv_conversions_total counter"]
+            for api in APIS:
+                lines.append('ccconv_conversions_total{api="%s"} %d' % (api, self.conversions[api]))
+            lines += ["# HELP ccconv_call_seconds Time spent per call, by API.",
+                "# TYPE ccconv_call_seconds histogram"]
+            for api in APIS:
+                lines += self.latency[api].Lines("ccconv_call_seconds", 'api="%s",' % api)
+            lines += ["# HELP ccconv_table_build_seconds Time spent building one year table.",
+                "# TYPE ccconv_table_build_seconds histogram"]
+            lines += self.builds.Lines("ccconv_table_build_seconds")
+            lines += ["# HELP ccconv_easter_computations_total Easter dates computed.",
+                "# TYPE ccconv_easter_computations_total counter",
+                "ccconv_easter_computations_total %d" % self.easters]
+        for name, kind, text, value in (
+                ("hits_total", "counter", "Year table cache hits.", hits),
+                ("misses_total", "counter", "Year table cache misses.", misses),
+                ("evictions_total", "counter", "Year tables evicted from the cache.", evictions),
+                ("years", "gauge", "Year tables in the cache.", info.curryears),
+                ("max_years", "gauge", "Cache size limit in years (-1 for none).",
+                    -1 if info.maxyears is None else info.maxyears)):
+            lines += ["# HELP ccconv_cache_%s %s" % (name, text),
+                "# TYPE ccconv_cache_%s %s" % (name, kind),
+                "ccconv_cache_%s %d" % (name, value)]
+        return "\n".join(lines) + "\n"
+
+metrics = converterMetrics()
+
+def EnableMetrics(enabled=True):
+    metrics.enabled = enabled
+
+def WriteMetrics(path):
+    # Atomic, for the node_exporter textfile collector and the like
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(metrics.Render())
+    os.replace(temp, path)
+
+def ServeMetrics(port=9464, host="127.0.0.1"):
+    # GET /metrics on a daemon thread; returns the server for shutdown()
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    class metricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.Render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    EnableMetrics()
+    server = ThreadingHTTPServer((host, port), metricsHandler)
+    threading.Thread(target=server.serve_forever, name="ccconv-metrics", daemon=True).start()
+    return server
+
+
+
+#=====================================
+# NOTE Command Line
+#=====================================
+
+def FormatRow(datein, cal):
+    # Fields the slow path could not work out are shown as -
+    fields = [getattr(cal, field, False) for field in ("year", "churchseason", "churchweek", "day", "holyday")]
+    if fields[-1]:
+        fields[-1] = "; ".join(fields[-1])
+    return "\t".join([datein.isoformat()] + [str(field) if field is not False else "-" for field in fields])
+
+def ReadArgument(text):
+    # The date of a command line argument, or None after reporting it
+    try:
+        return ParseLine(text)
+    except (TypeError, ValueError, OverflowError):
+        print(ConversionError("input", text), file=sys.stderr)
+        return None
+
+def CommandConvert(args):
+    status = 0
+    report = batchReport()
+    for text in args.dates:
+        datein = ReadArgument(text)
+        if datein is None:
+            status = 1
+            continue
+        print(FormatRow(datein, churchCalendar(datein, report=report)))
+    return status
+
+def CommandGrid(args):
+    firstweekday = 0 if args.monday else 6
+    if args.month is None:
+        grid = year_grid(args.year, firstweekday)
+    else:
+        grid = month_grid(args.year, args.month, firstweekday)
+    print(render_html(grid) if args.html else render_text(grid))
+    return 0
+
+def CommandExplain(args):
+    status = 0
+    for text in args.dates:
+        datein = ReadArgument(text)
+        if datein is None:
+            status = 1
+            continue
+        print(FormatExplanation(explain(text)))
+    return status
+
+#----- Annotate ----------
+# Streams dates (ISO or proleptic ordinals, one per line) to JSON Lines,
+# a chunk of lines at a time.  Output for recent dates is memoised, but
+# only up to a fixed number of entries, so memory stays flat.  Lines that
+# fail become error objects and, given a batchReport, are counted there.
+
+def ParseLine(text):
+    return date.fromordinal(ToOrdinal(text))
+
+def AnnotateStream(infile, outfile, chunk=8192, memo=65536, observances=None, report=None):
+    import json
+    from itertools import islice
+    if observances is None:
+        observances = registry
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    seen = {}
+    while True:
+        lines = list(islice(infile, chunk))
+        if not lines:
+            break
+        out = []
+        for line in lines:
+            text = line.strip()
+            if not text:
+                continue
+            if report is not None:
+                report.total += 1
+            row = seen.get(text)
+            if row is None:
+                try:
+                    datein = ParseLine(text)
+                    cal = churchCalendar(datein, observances, strict=True)
+                except (TypeError, ValueError, OverflowError) as e:
+                    if report is not None:
+                        report.Add(text, getattr(e, "stage", "input"), e)
+                    out.append(encode({"input": text, "error": str(e)}))
+                    continue
+                fields = {"date": datein.isoformat()}
+                fields.update(cal.__dict__)
+                row = encode(fields)
+                if len(seen) >= memo:
+                    seen.clear()
+                seen[text] = row
+            out.append(row)
+        if out:
+            outfile.write("\n".join(out))
+            outfile.write("\n")
+    outfile.flush()
+
+def CommandAnnotate(args):
+    import io
+    infile = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", errors="replace")
+    outfile = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", write_through=False)
+    report = batchReport() if args.report else None
+    try:
+        AnnotateStream(infile, outfile, args.chunk, report=report)
+    except BrokenPipeError:
+        # Downstream closed early, e.g. piped into head
+        sys.stderr.close()
+        return 0
+    if report is not None:
+        print(report.Summary(), file=sys.stderr)
+    return 0
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="ccconv2",
+        description="Convert Gregorian dates to the Anglican Church liturgical calendar.")
+    parser.add_argument("--warm", type=int, metavar="N", default=None,
+        help="build the year tables for the current year +/-N in the background")
+    parser.add_argument("--warm-center", type=int, metavar="YEAR", default=None,
+        help="centre the warm-up window on YEAR instead of the current year")
+    parser.add_argument("--roll", action="store_true",
+        help="keep moving the warm-up window forward with the current year (not with --warm-center)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT", default=None,
+        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running")
+    parser.add_argument("--metrics-file", metavar="PATH", default=None,
+        help="write Prometheus metrics to PATH when the command finishes")
+    commands = parser.add_subparsers(dest="command")
+    convert = commands.add_parser("convert", help="print the church calendar for dates (ISO or ordinal)")
+    convert.add_argument("dates", nargs="+", metavar="DATE")
+    convert.set_defaults(run=CommandConvert)
+    explainer = commands.add_parser("explain", help="show how each field of a date is worked out")
+    explainer.add_argument("dates", nargs="+", metavar="DATE")
+    explainer.set_defaults(run=CommandExplain)
+    grid = commands.add_parser("grid", help="print a month or a whole year as a calendar")
+    grid.add_argument("year", type=int)
+    grid.add_argument("month", type=int, nargs="?", default=None)
+    grid.add_argument("--html", action="store_true", help="write an HTML table instead of text")
+    grid.add_argument("--monday", action="store_true", help="start weeks on Monday")
+    grid.set_defaults(run=CommandGrid)
+    annotate = commands.add_parser("annotate",
+        help="read dates from stdin, one per line, and write JSON Lines to stdout")
+    annotate.add_argument("--chunk", type=int, metavar="LINES", default=8192,
+        help="number of lines read and written at a time")
+    annotate.add_argument("--report", action="store_true",
+        help="print a summary of failed lines to stderr at the end")
+    annotate.set_defaults(run=CommandAnnotate)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.roll and args.warm_center is not None:
+        parser.error("--roll follows the current year and cannot be used with --warm-center")
+    if args.warm is not None:
+        try:
+            WarmYears(args.warm, args.warm_center, args.roll)
+        except ValueError as err:
+            parser.exit(2, "%s\n" % err)
+    if args.metrics_port is not None:
+        ServeMetrics(args.metrics_port)
+    elif args.metrics_file is not None:
+        EnableMetrics()
+    status = args.run(args)
+    if args.metrics_file is not None:
+        WriteMetrics(args.metrics_file)
+    return status
+
+if __name__ == "__main__":
+    raise SystemExit(main())
+
+
+
 #=====================================
 # NOTE Test variable settings
 # In order to test THIS PAGE ONLY
@@ -0,0 +1,326 @@
+#----------------------------------------------------------------------------------#
+# Golden Dataset for the Church Calendar Converter
+# Reference output of ccconv2 for every day of a span of years, stored
+# as compressed columns, and a checker that compares any engine with it.
+#----------------------------------------------------------------------------------#
+
+import calendar, json, os, struct, sys, time, zlib
+from array import array
+from datetime import date
+
+import ccconv2 as cc
+
+#=====================================
+# NOTE Golden File
+#=====================================
+# Header: magic, version, first year, last year, vocabulary length
+# Then the vocabulary as JSON (the distinct values of each field, in
+# code order), then for each field its compressed length and a zlib
+# stream of uint16 codes, one per day from January 1 of the first year.
+#
+# The fields are those the reference functions (ConvertYear,
+# ConvertSeason, ConvertWeek, HolyDays) produce.  Colour and rank exist
+# only in the year tables, the engine being checked, so they are left
+# out rather than compared with themselves.
+
+GOLDENHEADER = struct.Struct("<4sIiiI")
+GOLDENMAGIC = b"CCGD"
+GOLDENVERSION = 2
+GOLDENPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden.ccg")
+GOLDENFIRST = 1583
+GOLDENLAST = 4099
+
+FIELDS = ("year", "churchseason", "churchweek", "holyday")
+
+def ValueKey(value):
+    # Holy days are lists, which cannot be dictionary keys
+    return tuple(value) if type(value) is list else value
+
+class goldenData:
+    def __init__(self, first, last, values, columns):
+        self.first = first
+        self.last = last
+        self.start = date(first, 1, 1).toordinal()
+        self.values = values
+        self.codes = [dict((ValueKey(value), code) for code, value in enumerate(values[field]))
+            for field in FIELDS]
+        self.columns = columns
+
+    def Slice(self, field, year):
+        i = date(year, 1, 1).toordinal() - self.start
+        return self.columns[field][i:i + (366 if calendar.isleap(year) else 365)]
+
+    def Value(self, field, code):
+        values = self.values[FIELDS[field]]
+        return values[code] if code < len(values) else "<not in golden data>"
+
+def ReferenceColumns(year):
+    # The slow path, one reference call per field per day
+    columns = [[] for field in FIELDS]
+    start = date(year, 1, 1).toordinal()
+    for o in range(start, date(year, 12, 31).toordinal() + 1):
+        datein = date.fromordinal(o)
+        columns[0].append(cc.ConvertYear(datein))
+        columns[1].append(cc.ConvertSeason(datein))
+        columns[2].append(cc.ConvertWeek(datein))
+        columns[3].append(cc.HolyDays(datein))
+    return columns
+
+def GenerateGolden(path=GOLDENPATH, first=GOLDENFIRST, last=GOLDENLAST, engine=ReferenceColumns, progress=None):
+    values = [[] for field in FIELDS]
+    codes = [{} for field in FIELDS]
+    columns = [array("H") for field in FIELDS]
+    for year in range(first, last + 1):
+        for field, column in enumerate(engine(year)):
+            seen = codes[field]
+            for value in column:
+                key = ValueKey(value)
+                code = seen.get(key)
+                if code is None:
+                    code = seen[key] = len(values[field])
+                    values[field].append(value)
+                columns[field].append(code)
+        if progress is not None:
+            progress(year)
+    vocabulary = json.dumps(dict(zip(FIELDS, values)), ensure_ascii=False).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(GOLDENHEADER.pack(GOLDENMAGIC, GOLDENVERSION, first, last, len(vocabulary)))
+        f.write(vocabulary)
+        for column in columns:
+            if sys.byteorder != "little":
+                column.byteswap()
+            data = zlib.compress(column.tobytes(), 9)
+            f.write(struct.pack("<I", len(data)))
+            f.write(data)
+
+def LoadGolden(path=GOLDENPATH):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, first, last, size = GOLDENHEADER.unpack_from(data, 0)
+    if magic != GOLDENMAGIC or version != GOLDENVERSION:
+        raise ValueError("Error: %s is not a golden dataset." % path)
+    offset = GOLDENHEADER.size
+    values = json.loads(data[offset:offset + size].decode("utf-8"))
+    offset += size
+    columns = []
+    for field in FIELDS:
+        length, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        column = array("H", zlib.decompress(data[offset:offset + length]))
+        if sys.byteorder != "little":
+            column.byteswap()
+        columns.append(column)
+        offset += length
+    return goldenData(first, last, values, columns)
+
+#=====================================
+# NOTE Engines
+#=====================================
+# An engine maps a year to one list of values per field, in FIELDS
+# order, with every day of the year.  MakeEngine returns one by name:
+#   table       year tables built from the rule set
+#   shared      the same tables through the shared memory layout
+#   calendar    churchCalendar, one object per day
+#   reference   the reference functions (as used to generate)
+# or, for any other name, the shared layout saved in that file.
+
+def TableColumns(table):
+    return [
+        [cc.CYCLES[code] for code in table.cycle],
+        [cc.SEASONS[code] for code in table.season],
+        [cc.WEEKS[code] for code in table.week],
+        [table.HolyDays(i) if mask else False for i, mask in enumerate(table.holy)],
+    ]
+
+def CalendarColumns(year):
+    columns = [[] for field in FIELDS]
+    start = date(year, 1, 1).toordinal()
+    for o in range(start, date(year, 12, 31).toordinal() + 1):
+        cal = cc.churchCalendar(date.fromordinal(o), strict=True)
+        for field, column in zip(FIELDS, columns):
+            column.append(getattr(cal, field))
+    return columns
+
+def MakeEngine(name, first, last):
+    if name == "table":
+        return lambda year: TableColumns(cc.BuildYearTable(year))
+    if name == "shared":
+        buf = bytearray(cc.EncodedSize(first, last))
+        cc.EncodeYears(buf, first, last)
+        shared = cc.sharedYears(buf)
+    elif name == "calendar":
+        return CalendarColumns
+    elif name == "reference":
+        return ReferenceColumns
+    else:
+        shared = cc.MapYears(name)
+        if shared.first > first or shared.last < last:
+            raise ValueError("Error: %s holds %d-%d only." % (name, shared.first, shared.last))
+    return lambda year: TableColumns(shared.Table(year))
+
+#=====================================
+# NOTE Checker
+#=====================================
+# Each year of each field is turned into an array of golden codes and
+# compared with the stored slice in one step; days are only looked at
+# one by one in the (rare) years that differ.
+
+def CheckEngine(engine, golden, first=None, last=None, keep=5):
+    # {field: (divergent days, [(date, expected, got), ...])}
+    first = golden.first if first is None else first
+    last = golden.last if last is None else last
+    if first < golden.first or last > golden.last:
+        raise ValueError("Error: The golden data covers %d-%d only." % (golden.first, golden.last))
+    result = dict((field, [0, []]) for field in FIELDS)
+    for year in range(first, last + 1):
+        columns = engine(year)
+        for field, column in enumerate(columns):
+            codes = golden.codes[field]
+            missing = len(golden.values[FIELDS[field]])
+            got = array("H", [codes.get(ValueKey(value), missing) for value in column])
+            expected = golden.Slice(field, year)
+            if got == expected:
+                continue
+            entry = result[FIELDS[field]]
+            start = date(year, 1, 1).toordinal()
+            for i in range(max(len(got), len(expected))):
+                a = expected[i] if i < len(expected) else None
+                b = got[i] if i < len(got) else None
+                if a == b:
+                    continue
+                entry[0] += 1
+                if len(entry[1]) < keep:
+                    entry[1].append((date.fromordinal(start + i),
+                        golden.Value(field, a) if a is not None else None,
+                        column[i] if b is not None else None))
+    return dict((field, tuple(entry)) for field, entry in result.items())
+
+#=====================================
+# NOTE Precedence
+#=====================================
+# The golden data leaves out rank and the principal observance, so
+# ResolvePrecedence is checked here instead: known days, plus two rules
+# for every year of the span.
+#   own day    a feast moved off its day never takes another feast's own day
+#   sundays    only Sundays are ranked Sunday
+
+PRECEDENCECASES = [
+    # Stephen falls on Christmas One and moves past John and the Innocents
+    (date(1909, 12, 26), "Christmas One", "Sunday"),
+    (date(1909, 12, 27), "John the Apostle and Evangelist", "Holy Day"),
+    (date(1909, 12, 28), "The Holy Innocents", "Holy Day"),
+    (date(1909, 12, 29), "Stephen, Deacon and Martyr", "Holy Day"),
+    # A Saturday after Christmas is a weekday, not a Sunday
+    (date(2022, 12, 31), "Christmas", "Weekday"),
+    # The README examples
+    (date(2025, 4, 25), "Easter One", "Privileged Day"),
+    (date(2025, 4, 28), "Mark the Evangelist", "Holy Day"),
+]
+
+def PrecedenceProblems(table):
+    # [(date, problem)] for one year table
+    problems = []
+    rules = table.rules
+    ordinals = rules.Evaluate(table.year)
+    feasts = len(cc.WEEKS)
+    for code, index in enumerate(rules.feasts):
+        i = ordinals[index] - table.start
+        if i < 0 or i >= table.length or rules.ranks[code] == cc.CIVIL:
+            continue
+        other = table.principal[i] - feasts
+        if other >= 0 and other != code and ordinals[rules.feasts[other]] != table.start + i:
+            problems.append((date.fromordinal(table.start + i), "%s takes the own day of %s"
+                % (rules.names[other], rules.names[code])))
+    for i, rank in enumerate(table.rank):
+        if rank == cc.SUNDAYRANK and (table.start + i) % 7:
+            problems.append((date.fromordinal(table.start + i), "%s ranked Sunday on a %s"
+                % (table.Principal(i), calendar.day_name[date.fromordinal(table.start + i).weekday()])))
+    return problems
+
+def CheckPrecedence(first, last, keep=5):
+    # (problem count, [(date, problem), ...])
+    problems = []
+    for datein, principal, rank in PRECEDENCECASES:
+        got = cc.PrincipalObservance(datein)
+        if got != (principal, rank):
+            problems.append((datein, "expected %r got %r" % ((principal, rank), got)))
+    for year in range(first, last + 1):
+        problems.extend(PrecedenceProblems(cc.BuildYearTable(year)))
+    return len(problems), problems[:keep]
+
+#=====================================
+# NOTE Command Line
+#=====================================
+
+def CommandGenerate(args):
+    started = time.perf_counter()
+    def progress(year):
+        if year % 100 == 0:
+            print("%d ..." % year, file=sys.stderr, flush=True)
+    GenerateGolden(args.golden, args.first, args.last, progress=progress)
+    print("Wrote %s (%d bytes) in %.1fs." % (args.golden, os.path.getsize(args.golden),
+        time.perf_counter() - started))
+    return 0
+
+def CommandCheck(args):
+    golden = LoadGolden(args.golden)
+    first = golden.first if args.first is None else args.first
+    last = golden.last if args.last is None else args.last
+    started = time.perf_counter()
+    result = CheckEngine(MakeEngine(args.engine, first, last), golden, first, last, args.keep)
+    failed = 0
+    for field in FIELDS:
+        count, samples = result[field]
+        failed += count
+        print("%-12s %s" % (field, "ok" if not count else "%d days differ" % count))
+        for datein, expected, got in samples:
+            print("    %s expected %r got %r" % (datein.isoformat(), expected, got))
+    print("Checked %s against %d-%d in %.1fs." % (args.engine, first, last,
+        time.perf_counter() - started))
+    return 1 if failed else 0
+
+def CommandPrecedence(args):
+    first = GOLDENFIRST if args.first is None else args.first
+    last = GOLDENLAST if args.last is None else args.last
+    started = time.perf_counter()
+    count, problems = CheckPrecedence(first, last, args.keep)
+    print("%-12s %s" % ("precedence", "ok" if not count else "%d problems" % count))
+    for datein, problem in problems:
+        print("    %s %s" % (datein.isoformat(), problem))
+    print("Checked %d known days and %d-%d in %.1fs." % (len(PRECEDENCECASES), first, last,
+        time.perf_counter() - started))
+    return 1 if count else 0
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="ccgolden",
+        description="Generate the golden dataset or check an engine against it.")
+    parser.add_argument("--golden", metavar="PATH", default=GOLDENPATH,
+        help="golden dataset file (default: golden.ccg next to this script)")
+    commands = parser.add_subparsers(dest="command")
+    generate = commands.add_parser("generate", help="write the golden dataset from the reference functions")
+    generate.add_argument("--first", type=int, default=GOLDENFIRST)
+    generate.add_argument("--last", type=int, default=GOLDENLAST)
+    generate.set_defaults(run=CommandGenerate)
+    check = commands.add_parser("check", help="compare an engine with the golden dataset")
+    check.add_argument("engine", nargs="?", default="table",
+        help="table, shared, calendar, reference or a file saved with SaveYears")
+    check.add_argument("--first", type=int, default=None)
+    check.add_argument("--last", type=int, default=None)
+    check.add_argument("--keep", type=int, default=5, metavar="N",
+        help="divergent days listed per field")
+    check.set_defaults(run=CommandCheck)
+    precedence = commands.add_parser("precedence", help="check ranks and principal observances")
+    precedence.add_argument("--first", type=int, default=None)
+    precedence.add_argument("--last", type=int, default=None)
+    precedence.add_argument("--keep", type=int, default=5, metavar="N",
+        help="problems listed")
+    precedence.set_defaults(run=CommandPrecedence)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    return args.run(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())